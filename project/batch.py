@@ -0,0 +1,363 @@
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.queues import SimpleQueue
+from knowledge import knowledge_filename
+from maze import Maze
+from oracle import cached_solve, default_budget
+from policy import estimate_score
+from profiler import Profiler
+from tester import run_trial, train_score_ratio
+
+# columns of the batch report
+fields = ['maze', 'dim', 'score', 'first_run', 'second_run', 'steps', 'hit_goal',
+          'best_score', 'worst_score', 'optimal_score', 'optimal_bound', 'optimal_upper',
+          'optimal_gap', 'elapsed', 'error', 'trace']
+
+# seconds between checks for crashed workers while waiting for a trial
+poll_interval = 0.5
+
+# seconds a trial may stay not started while a worker is free, after a
+# worker has exited before starting a trial, until it's reported lost
+lost_interval = 5
+
+# queue of (maze file or None as the worker starts, worker process id) put
+# by workers as they start trials, set in workers of `run_batch`
+started = None
+
+
+class TrialTimeout(Exception):
+    """
+    Raised in a worker when a trial exceeds its time limit.
+    """
+
+
+def find_mazes(patterns):
+    """
+    Expands directories and glob patterns to a sorted list of maze files.
+    Directories are searched for *.txt files.
+    """
+
+    filenames = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.txt')
+        filenames.update(glob.glob(pattern))
+
+    return sorted(filenames)
+
+
+def init_worker(queue):
+    """
+    Sets the queue workers announce themselves and started trials to.
+    """
+
+    global started
+    started = queue
+    started.put((None, os.getpid()))
+
+
+def raise_timeout(signum, frame):
+    """
+    Interrupts a trial on SIGALRM.
+    """
+
+    raise TrialTimeout('Trial exceeded time limit.')
+
+
+def evaluate(task):
+    """
+    Runs a trial on a single maze file and returns a report row.
+    Task is (filename, timeout in seconds or None, whether to cache parsed
+    maze, directory for traces of failed trials or None, whether to
+    profile the trial, directory of robot's knowledge or None, directory of
+    oracle results or None, oracle budget, oracle time limit in seconds or
+    None). Errors and timeouts are reported in the `error` column instead
+    of being raised. Profiler stats are returned in the `profile` key,
+    which is not a report column.
+
+    With an oracle directory, bounds of the best achievable score are
+    added, and if the oracle proves the score within its budget and time
+    limit, the gap of the robot's score to it. The robot's score bounds
+    the oracle search unless the robot started with knowledge.
+    """
+
+    filename, timeout, cache, traces, profile, knowledge, oracle, oracle_budget, oracle_timeout = task
+    if started is not None:
+        started.put((filename, os.getpid()))
+
+    row = dict.fromkeys(fields)
+    row['maze'] = filename
+    warm = False
+    start = time.time()
+    if timeout:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.alarm(timeout)
+    try:
+        maze = Maze(filename, cache=cache)
+        row['dim'] = maze.dim
+
+        goal_bounds = [maze.dim / 2 - 1, maze.dim / 2]
+        row['best_score'], row['worst_score'] = estimate_score(maze, [0, 0], goal_bounds, train_score_ratio)
+        # a robot starting with knowledge can beat any robot which doesn't
+        warm = knowledge and os.path.exists(knowledge_filename(knowledge, maze))
+
+        if profile:
+            profiler = Profiler()
+            profiler.install()
+            try:
+                result = run_trial(maze, trace=traces is not None, knowledge=knowledge)
+            finally:
+                profiler.uninstall()
+            row['profile'] = profiler.to_dict()
+        else:
+            result = run_trial(maze, trace=traces is not None, knowledge=knowledge)
+        row['score'] = result.score
+        row['steps'] = result.steps
+        row['hit_goal'] = result.hit_goal
+        if len(result.runtimes) > 0:
+            row['first_run'] = result.runtimes[0]
+        if len(result.runtimes) > 1:
+            row['second_run'] = result.runtimes[1]
+        if traces is not None and result.score is None:
+            row['trace'] = os.path.join(traces, os.path.splitext(os.path.basename(filename))[0] + '.npz')
+            result.trace.save(row['trace'])
+    except Exception as e:
+        row['error'] = '{}: {}'.format(e.__class__.__name__, e)
+    finally:
+        if timeout:
+            signal.alarm(0)
+    if oracle and row['dim'] is not None:
+        try:
+            upper = row['score'] if not warm else None
+            result = cached_solve(maze, oracle, oracle_budget, upper=upper, time_limit=oracle_timeout)
+            row['optimal_score'] = result.score
+            row['optimal_bound'] = result.lower_bound
+            row['optimal_upper'] = result.upper_bound
+            if row['score'] is not None and result.score is not None:
+                row['optimal_gap'] = row['score'] - result.score
+        except Exception as e:
+            error = 'oracle {}: {}'.format(e.__class__.__name__, e)
+            row['error'] = '{}; {}'.format(row['error'], error) if row['error'] else error
+    row['elapsed'] = time.time() - start
+
+    return row
+
+
+def run_batch(filenames, workers=None, timeout=None, cache=True, traces=None, profiler=None, knowledge=None,
+              oracle=None, oracle_budget=default_budget, oracle_timeout=None, callback=None):
+    """
+    Evaluates the robot on every maze file using a pool of `workers`
+    processes (number of CPUs by default). Parsed mazes are cached next to
+    the files unless `cache` is unset. If `traces` directory is given,
+    trials are recorded and traces of failed ones are saved there. If
+    `profiler` is given, every trial is profiled and stats of all workers
+    are merged into it. If `knowledge` directory is given, robots start
+    with knowledge learned in the same mazes before and save theirs there.
+    If `oracle` directory is given, best achievable scores are found with
+    `oracle_budget` states and `oracle_timeout` seconds per maze and cached
+    there.
+    Returns report rows in order of files; `callback`
+    is called with every row as soon as it's ready.
+
+    A worker process which dies during a trial (a crash of the interpreter
+    or a kill, which the timeout doesn't cover) is replaced by the pool,
+    and the trial is reported with an error, as is a trial lost by a
+    worker which died before starting it.
+    """
+
+    if traces is not None and not os.path.isdir(traces):
+        os.makedirs(traces)
+
+    queue = SimpleQueue()
+    pool = multiprocessing.Pool(workers, init_worker, (queue,))
+    crashed = False
+    try:
+        rows = []
+        tasks = [(filename, timeout, cache, traces, profiler is not None, knowledge, oracle, oracle_budget,
+                  oracle_timeout) for filename in filenames]
+        results = [pool.apply_async(evaluate, (task,)) for task in tasks]
+        by_filename = dict(zip(filenames, results))
+        pids = {}
+        workers = {}
+        exited = []
+        for filename, result in zip(filenames, results):
+            row = wait_row(filename, result, queue, pids, workers, exited, by_filename)
+            crashed = crashed or not result.ready()
+            profile = row.pop('profile', None)
+            if profile:
+                profiler.merge(profile)
+            rows.append(row)
+            if callback:
+                callback(row)
+    finally:
+        # results of crashed trials never come, so the pool can't be closed
+        if crashed:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    return rows
+
+
+def wait_row(filename, result, queue, pids, workers, exited, results):
+    """
+    Waits for the report row of a trial. Workers announce themselves and
+    started trials on the queue, read to `workers` (process id to the last
+    started maze file, None before the first one) and `pids` (maze file to
+    process id). An error row is returned if the worker of this trial has
+    exited without a result, or if the trial hasn't started for
+    `lost_interval` seconds while a worker was free (or none was alive)
+    after a worker exited with no trial running, which may have lost it.
+    Process ids of such workers are kept in `exited`; `results` are async
+    results of all trials by maze file.
+    """
+
+    free_since = None
+    while not result.ready():
+        result.wait(poll_interval)
+        while not queue.empty():
+            started_filename, pid = queue.get()
+            workers[pid] = started_filename
+            if started_filename is not None:
+                pids[started_filename] = pid
+        alive = set(process.pid for process in multiprocessing.active_children())
+        for dead in [worker for worker in workers if worker not in alive]:
+            last = workers.pop(dead)
+            if last is None or results[last].ready():
+                exited.append(dead)
+        if result.ready():
+            break
+
+        row = dict.fromkeys(fields)
+        row['maze'] = filename
+        if filename in pids:
+            if pids[filename] not in alive:
+                row['error'] = 'WorkerCrashed: worker process {} exited during the trial'.format(pids[filename])
+                return row
+            continue
+        running = len([other for other, worker in pids.items() if worker in alive and not results[other].ready()])
+        if not exited or alive and len(alive) <= running:
+            free_since = None
+        elif free_since is None:
+            free_since = time.time()
+        elif time.time() - free_since > lost_interval:
+            row['error'] = 'WorkerCrashed: worker process {} exited before starting the trial'.format(exited.pop())
+            return row
+
+    return result.get()
+
+
+def summarize(rows):
+    """
+    Aggregates report rows: number of mazes, completed and failed trials,
+    mean score, mean gap to the best estimated score and, if the oracle
+    was run, mean gap to the best achievable score over completed trials
+    in which it was proven (`proven`).
+    """
+
+    completed = [row for row in rows if row['score'] is not None]
+    summary = {
+        'mazes': len(rows),
+        'completed': len(completed),
+        'errors': len([row for row in rows if row['error']]),
+        'mean_score': None,
+        'mean_gap': None,
+        'proven': 0,
+        'mean_optimal_gap': None
+    }
+    if completed:
+        summary['mean_score'] = sum(row['score'] for row in completed) / len(completed)
+        summary['mean_gap'] = sum(row['score'] - row['best_score'] for row in completed) / len(completed)
+    gaps = [row['optimal_gap'] for row in completed if row['optimal_gap'] is not None]
+    if gaps:
+        summary['proven'] = len(gaps)
+        summary['mean_optimal_gap'] = sum(gaps) / len(gaps)
+
+    return summary
+
+
+def write_report(filename, rows):
+    """
+    Writes report rows to CSV or, if filename ends with .json, to JSON
+    along with the summary.
+    """
+
+    with open(filename, 'wb') as f_out:
+        if filename.endswith('.json'):
+            json.dump({'mazes': rows, 'summary': summarize(rows)}, f_out, indent=2, sort_keys=True)
+        else:
+            writer = csv.DictWriter(f_out, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def print_row(row):
+    """
+    Prints a short report line for a single maze.
+    """
+
+    if row['error']:
+        print '{}: {}'.format(row['maze'], row['error'])
+    elif row['score'] is None:
+        print '{}: not completed in {} steps'.format(row['maze'], row['steps'])
+    elif row['optimal_gap'] is not None:
+        print '{}: {:4.3f} (optimal {:4.3f}, gap {:4.3f})'.format(row['maze'], row['score'], row['optimal_score'],
+                                                                  row['optimal_gap'])
+    elif row['optimal_bound'] is not None:
+        upper = '?' if row['optimal_upper'] is None else '{:4.3f}'.format(row['optimal_upper'])
+        print '{}: {:4.3f} (optimal between {:4.3f} and {})'.format(row['maze'], row['score'], row['optimal_bound'],
+                                                                    upper)
+    else:
+        print '{}: {:4.3f} (estimated {:4.3f} - {:4.3f})'.format(row['maze'], row['score'],
+                                                                 row['best_score'], row['worst_score'])
+
+
+if __name__ == '__main__':
+    '''
+    This script tests the robot on every maze from the given files,
+    directories or glob patterns in parallel and reports scores.
+    '''
+
+    parser = argparse.ArgumentParser(description='Evaluate the robot on a corpus of mazes.')
+    parser.add_argument('mazes', nargs='+', help='maze files, directories or glob patterns')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-t', '--timeout', type=int, default=None, help='time limit per maze in seconds')
+    parser.add_argument('-o', '--output', default=None, help='report file (.csv or .json)')
+    parser.add_argument('--no-cache', action='store_true', help='do not cache parsed mazes next to the files')
+    parser.add_argument('--traces', default=None, help='directory to save traces of failed trials to')
+    parser.add_argument('--profile', default=None, help='JSON file to write merged profiler stats to')
+    parser.add_argument('--knowledge', default=None, help='directory to keep robot\'s knowledge of every maze in')
+    parser.add_argument('--oracle', default=None, help='directory to cache best achievable scores in')
+    parser.add_argument('--oracle-budget', type=int, default=default_budget, help='oracle states expanded per maze')
+    parser.add_argument('--oracle-timeout', type=int, default=None,
+                        help='oracle time limit per maze in seconds, the trial time limit by default')
+    args = parser.parse_args()
+
+    filenames = find_mazes(args.mazes)
+    profiler = Profiler() if args.profile else None
+    rows = run_batch(filenames, workers=args.workers, timeout=args.timeout, cache=not args.no_cache,
+                     traces=args.traces, profiler=profiler, knowledge=args.knowledge,
+                     oracle=args.oracle, oracle_budget=args.oracle_budget,
+                     oracle_timeout=args.oracle_timeout or args.timeout, callback=print_row)
+
+    summary = summarize(rows)
+    print 'Completed {} of {} mazes, errors: {}.'.format(summary['completed'], summary['mazes'], summary['errors'])
+    if summary['completed']:
+        print 'Mean score: {:4.3f}, mean gap to best estimate: {:4.3f}'.format(summary['mean_score'],
+                                                                               summary['mean_gap'])
+    if summary['mean_optimal_gap'] is not None:
+        print 'Mean gap to optimal score on {} mazes: {:4.3f}'.format(summary['proven'], summary['mean_optimal_gap'])
+
+    if args.output:
+        write_report(args.output, rows)
+
+    if profiler:
+        profiler.write(args.profile)
+        profiler.report()
@@ -0,0 +1,418 @@
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+import numpy as np
+from timeit import default_timer as timer
+from generator import generate, topologies
+from maze import Maze
+from oracle import solve
+from policy import IncrementalPolicy, compute_path, compute_policy, headings
+from robot import Maze as RobotMaze
+from robot import Robot
+from tester import run_trial, max_time
+
+# sample mazes run by the macro suite
+test_mazes = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mazes', 'test_maze_*.txt')
+
+# latency percentiles reported by the suite
+percentiles = [50, 90, 99]
+
+
+def measure(function, repeat=3):
+    """
+    Returns the best wall clock time of `repeat` calls of the function
+    in seconds.
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def timed_robot(times):
+    """
+    Returns a robot factory which appends the duration of every
+    `next_move` call to `times`.
+    """
+
+    def factory(maze_dim, init, goal_bounds):
+        robot = Robot(maze_dim, init, goal_bounds)
+        next_move = robot.next_move
+
+        def timed_next_move(sensors):
+            start = time.time()
+            move = next_move(sensors)
+            times.append(time.time() - start)
+            return move
+
+        robot.next_move = timed_next_move
+        return robot
+
+    return factory
+
+
+def scaling(dims, trial_dims, topology='apec', seed=0, repeat=3, callback=None):
+    """
+    Measures how planning and trials grow with the grid size on generated
+    mazes. For every dimension reports compute_policy time for both engines
+    on the fully known maze and, for dimensions in `trial_dims`, mean
+    `Robot.next_move` time and total time of a trial. Time limit of a trial
+    grows with the maze area.
+    """
+
+    rows = []
+    for dim in dims:
+        maze = generate(dim, topology, seed)
+        goals = [[x, y] for x in [dim / 2 - 1, dim / 2] for y in [dim / 2 - 1, dim / 2]]
+
+        row = {'dim': dim, 'policy': None, 'wavefront': None,
+               'next_move': None, 'trial': None, 'steps': None, 'score': None}
+        row['policy'] = measure(lambda: compute_policy(maze, goals), repeat)
+        row['wavefront'] = measure(lambda: compute_policy(maze, goals, vectorized=True), repeat)
+
+        if dim in trial_dims:
+            times = []
+            start = time.time()
+            result = run_trial(maze, timed_robot(times), max_time=max(max_time, 4 * dim * dim))
+            row['trial'] = time.time() - start
+            row['next_move'] = sum(times) / len(times)
+            row['steps'] = result.steps
+            row['score'] = result.score
+
+        rows.append(row)
+        if callback:
+            callback(row)
+
+    return rows
+
+
+def latencies(function, samples, batch=1):
+    """
+    Times `samples` batches of `batch` calls of the function and returns
+    list of mean per-call times in seconds, one for every batch.
+    """
+
+    times = []
+    for _ in range(samples):
+        start = timer()
+        for _ in range(batch):
+            function()
+        times.append((timer() - start) / batch)
+
+    return times
+
+
+def summarize(times, **extra):
+    """
+    Summarizes per-call times: number of samples, mean and percentiles
+    in seconds, along with `extra` values.
+    """
+
+    summary = dict(extra)
+    summary['samples'] = len(times)
+    summary['mean'] = float(np.mean(times))
+    for percentile in percentiles:
+        summary['p{}'.format(percentile)] = float(np.percentile(times, percentile))
+
+    return summary
+
+
+def explored(maze, steps):
+    """
+    Returns robot's map of the maze after `steps` time steps of a trial,
+    a partially known map.
+    """
+
+    robots = []
+
+    def factory(maze_dim, init, goal_bounds):
+        robots.append(Robot(maze_dim, init, goal_bounds))
+        return robots[-1]
+
+    run_trial(maze, factory, max_time=steps)
+    return robots[0].maze
+
+
+def micro(dim=32, seed=0, partial_steps=100, samples=20):
+    """
+    Times planning and maze queries on a generated maze: compute_policy for
+    both engines and compute_path on the fully known maze and on the
+    robot's map after `partial_steps` steps, learning of every edge with
+    robot.Maze.set_wall, robot.Maze.is_permissible and maze.Maze.dist_to_wall
+    for every cell and direction. Returns dict of summaries by name.
+    """
+
+    maze = generate(dim, 'apec', seed)
+    goals = [[x, y] for x in [dim / 2 - 1, dim / 2] for y in [dim / 2 - 1, dim / 2]]
+    init = [0, 0]
+    edges = [([x, y], i, not maze.is_permissible([x, y], heading))
+             for x in range(dim) for y in range(dim) for i, heading in enumerate(headings)]
+
+    results = {}
+    for knowledge, known in [('full', maze), ('partial', explored(maze, partial_steps))]:
+        policy = compute_policy(known, goals)
+        results['compute_policy ' + knowledge] = summarize(latencies(lambda: compute_policy(known, goals), samples))
+        results['wavefront ' + knowledge] = summarize(
+            latencies(lambda: compute_policy(known, goals, vectorized=True), samples))
+        results['compute_path ' + knowledge] = summarize(latencies(lambda: compute_path(policy, init), samples, 10))
+
+    def learn():
+        robot_maze = RobotMaze(dim)
+        start = timer()
+        for cell, heading, is_wall in edges:
+            robot_maze.set_wall(cell, heading, is_wall)
+        return (timer() - start) / len(edges)
+
+    robot_maze = RobotMaze(dim)
+    for cell, heading, is_wall in edges:
+        robot_maze.set_wall(cell, heading, is_wall)
+
+    def permissible():
+        start = timer()
+        for cell, heading, _ in edges:
+            robot_maze.is_permissible(cell, heading)
+        return (timer() - start) / len(edges)
+
+    def dist_to_wall():
+        start = timer()
+        for cell, heading, _ in edges:
+            maze.dist_to_wall(cell, headings[heading])
+        return (timer() - start) / len(edges)
+
+    results['set_wall'] = summarize([learn() for _ in range(samples)])
+    results['is_permissible'] = summarize([permissible() for _ in range(samples)])
+    results['dist_to_wall'] = summarize([dist_to_wall() for _ in range(samples)])
+
+    return results
+
+
+def macro(filenames, dims, seed=0):
+    """
+    Runs complete trials on maze files and generated mazes of `dims`
+    dimensions. Reports latencies of `Robot.next_move`, simulated steps
+    per second and score. Returns dict of summaries by name.
+    """
+
+    mazes = [Maze(filename) for filename in filenames] + [generate(dim, 'apec', seed) for dim in dims]
+
+    results = {}
+    for maze in mazes:
+        times = []
+        start = timer()
+        result = run_trial(maze, timed_robot(times), max_time=max(max_time, 4 * maze.dim * maze.dim))
+        elapsed = timer() - start
+        name = 'trial ' + os.path.splitext(os.path.basename(maze.filename))[0]
+        results[name] = summarize(times, steps=result.steps, score=result.score,
+                                  steps_per_second=result.steps / elapsed)
+
+    return results
+
+
+def check_policy(dims, seeds=3):
+    """
+    Replays sensor rays of every cell in random order on generated mazes
+    of every topology and checks after every update that IncrementalPolicy
+    equals compute_policy on the same robot's map: time, heading and
+    movement of every cell which isn't pruned. Returns number of updates
+    and list of (dim, topology, seed, update) where they differ.
+    """
+
+    updates = 0
+    mismatches = []
+    for dim in dims:
+        goals = [[x, y] for x in [dim / 2 - 1, dim / 2] for y in [dim / 2 - 1, dim / 2]]
+        for topology in topologies:
+            for seed in range(seeds):
+                maze = generate(dim, topology, seed)
+                robot_maze = RobotMaze(dim)
+                robot_maze.enable_pruning([0, 0], goals)
+                planner = IncrementalPolicy(robot_maze, goals)
+                rays = [([x, y], heading) for x in range(dim) for y in range(dim) for heading in range(len(headings))]
+                random.Random(seed).shuffle(rays)
+                for cell, heading in rays:
+                    walls = robot_maze.mark_ray(cell, heading, maze.dist_to_wall(cell, headings[heading]))
+                    if not walls:
+                        continue
+                    planner.update(walls)
+                    updates += 1
+                    policy = compute_policy(robot_maze, goals)
+                    kept = np.frombuffer(robot_maze.pruned, dtype=np.uint8) == 0
+                    if any((np.asarray(getattr(planner.policy, name)) != np.asarray(getattr(policy, name)))[kept].any()
+                           for name in ('time', 'heading', 'movement')):
+                        mismatches.append((dim, topology, seed, updates))
+
+    return updates, mismatches
+
+
+def check_oracle(filenames, time_limit=10):
+    """
+    Runs the oracle on maze files for up to `time_limit` seconds each and
+    checks that it brackets the best achievable score: the upper bound is
+    found and no lower than the lower bound. Returns list of (filename,
+    OracleResult, passed).
+    """
+
+    rows = []
+    for filename in filenames:
+        result = solve(Maze(filename), time_limit=time_limit)
+        passed = result.upper_bound is not None and result.lower_bound <= result.upper_bound
+        rows.append((filename, result, passed))
+
+    return rows
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compares median latencies with the baseline. Returns list of (name,
+    baseline median, median, ratio, regressed) for benchmarks present in
+    both, where `regressed` is set if the median grew more than
+    `threshold` share.
+    """
+
+    rows = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name]['p50'] / baseline[name]['p50']
+        rows.append((name, baseline[name]['p50'], results[name]['p50'], ratio, ratio > 1 + threshold))
+
+    return rows
+
+
+def print_suite(results):
+    """
+    Prints the suite table, latencies in microseconds.
+    """
+
+    print '{:<28} {:>8} {:>12} {:>12} {:>12} {:>12} {:>10}'.format(
+        'benchmark', 'samples', 'mean, us', 'p50, us', 'p90, us', 'p99, us', 'steps/s')
+    for name in sorted(results):
+        row = results[name]
+        print '{:<28} {:>8} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f} {:>10}'.format(
+            name, row['samples'], row['mean'] * 1e6, row['p50'] * 1e6, row['p90'] * 1e6, row['p99'] * 1e6,
+            '{:.0f}'.format(row['steps_per_second']) if 'steps_per_second' in row else '-')
+
+
+def print_comparison(rows, results, baseline):
+    """
+    Prints comparison with the baseline and changed scores.
+    """
+
+    print '{:<28} {:>12} {:>12} {:>8}'.format('benchmark', 'base p50, us', 'p50, us', 'ratio')
+    for name, base, median, ratio, regressed in rows:
+        print '{:<28} {:>12.2f} {:>12.2f} {:>8.2f}{}'.format(name, base * 1e6, median * 1e6, ratio,
+                                                             '  REGRESSION' if regressed else '')
+    for name in sorted(results):
+        if name in baseline and results[name].get('score') != baseline[name].get('score'):
+            print '{}: score changed from {} to {}'.format(name, baseline[name].get('score'),
+                                                           results[name].get('score'))
+
+
+def format_time(seconds):
+    """
+    Formats duration in milliseconds, or dash if it's not measured.
+    """
+
+    return '-' if seconds is None else '{:.2f}'.format(seconds * 1000)
+
+
+def print_scaling_row(row):
+    """
+    Prints a line of the scaling table.
+    """
+
+    print '{:>5} {:>12} {:>12} {:>12} {:>12} {:>8} {:>10}'.format(
+        row['dim'], format_time(row['policy']), format_time(row['wavefront']),
+        format_time(row['next_move']), format_time(row['trial']),
+        '-' if row['steps'] is None else row['steps'],
+        '-' if row['score'] is None else '{:.3f}'.format(row['score']))
+
+
+if __name__ == '__main__':
+    '''
+    This script benchmarks planning and simulation code.
+    '''
+
+    parser = argparse.ArgumentParser(description='Benchmark planning and simulation.')
+    commands = parser.add_subparsers(dest='command')
+
+    parser_scaling = commands.add_parser('scaling', help='measure growth with the grid size on generated mazes')
+    parser_scaling.add_argument('-d', '--dims', type=int, nargs='+', default=[16, 32, 64, 128, 256],
+                                help='maze dimensions')
+    parser_scaling.add_argument('--trial-dims', type=int, nargs='+', default=[16, 32],
+                                help='maze dimensions to run full trials on')
+    parser_scaling.add_argument('-t', '--topology', choices=topologies, default='apec', help='maze topology')
+    parser_scaling.add_argument('-s', '--seed', type=int, default=0, help='maze seed')
+    parser_scaling.add_argument('-r', '--repeat', type=int, default=3, help='repetitions of every measurement')
+
+    parser_suite = commands.add_parser('suite', help='run micro and macro benchmarks of hot paths')
+    parser_suite.add_argument('-d', '--dim', type=int, default=32, help='maze dimensions of micro benchmarks')
+    parser_suite.add_argument('--partial-steps', type=int, default=100,
+                              help='steps of exploration for partially known maps')
+    parser_suite.add_argument('--samples', type=int, default=20, help='samples of every micro benchmark')
+    parser_suite.add_argument('--trial-dims', type=int, nargs='*', default=[32],
+                              help='dimensions of generated mazes to run trials on')
+    parser_suite.add_argument('--skip-micro', action='store_true', help='do not run micro benchmarks')
+    parser_suite.add_argument('--skip-trials', action='store_true', help='do not run trials')
+    parser_suite.add_argument('-o', '--output', default=None, help='save results as a baseline file (.json)')
+    parser_suite.add_argument('-c', '--compare', default=None, help='baseline file to compare results with')
+    parser_suite.add_argument('--threshold', type=float, default=0.1,
+                              help='share of median latency growth reported as regression')
+
+    parser_check = commands.add_parser('check', help='check incremental planning and the oracle')
+    parser_check.add_argument('-d', '--dims', type=int, nargs='+', default=[6, 8, 12, 16],
+                              help='dimensions of generated mazes to replay walls on')
+    parser_check.add_argument('-s', '--seeds', type=int, default=3, help='generated mazes of every topology')
+    parser_check.add_argument('-t', '--timeout', type=int, default=10,
+                              help='time limit of the oracle per maze in seconds')
+
+    args = parser.parse_args()
+
+    if args.command == 'scaling':
+        print '{:>5} {:>12} {:>12} {:>12} {:>12} {:>8} {:>10}'.format(
+            'dim', 'policy, ms', 'vector, ms', 'move, ms', 'trial, ms', 'steps', 'score')
+        scaling(args.dims, args.trial_dims, args.topology, args.seed, args.repeat, callback=print_scaling_row)
+    elif args.command == 'suite':
+        results = {}
+        if not args.skip_micro:
+            results.update(micro(args.dim, partial_steps=args.partial_steps, samples=args.samples))
+        if not args.skip_trials:
+            results.update(macro(sorted(glob.glob(test_mazes)), args.trial_dims))
+        print_suite(results)
+
+        if args.output:
+            with open(args.output, 'wb') as f_out:
+                json.dump(results, f_out, indent=2, sort_keys=True)
+
+        if args.compare:
+            with open(args.compare, 'rb') as f_in:
+                baseline = json.load(f_in)
+            rows = compare(results, baseline, args.threshold)
+            print
+            print_comparison(rows, results, baseline)
+            if any(regressed for _, _, _, _, regressed in rows):
+                sys.exit(1)
+    elif args.command == 'check':
+        updates, mismatches = check_policy(args.dims, args.seeds)
+        print 'incremental policy: {} updates, {} mismatches'.format(updates, len(mismatches))
+        for dim, topology, seed, update in mismatches:
+            print 'incremental policy {} {} seed {}: differs after update {}  FAILED'.format(
+                dim, topology, seed, update)
+        rows = check_oracle(sorted(glob.glob(test_mazes)), args.timeout)
+        for filename, result, passed in rows:
+            print 'oracle {}: between {:4.3f} and {} ({} states){}'.format(
+                os.path.basename(filename), result.lower_bound,
+                '-' if result.upper_bound is None else '{:.3f}'.format(result.upper_bound), result.nodes,
+                '' if passed else '  FAILED')
+        if mismatches or not all(passed for _, _, passed in rows):
+            sys.exit(1)
@@ -0,0 +1,254 @@
+import argparse
+import time
+import numpy as np
+from policy import heading_move, headings, max_movement
+from tester import max_time, train_score_ratio
+from vecsim import Lanes
+
+# actions are coded as rotation index * 7 + movement + 3 for rotations
+# -90, 0 and 90 and movements in [-3, 3]; the last action is a reset
+rotations = [-90, 0, 90]
+movements = range(-max_movement, max_movement + 1)
+reset_action = len(rotations) * len(movements)
+action_count = reset_action + 1
+
+# rotation (as change of heading index) and movement of every action
+action_turn = [rotation / 90 for rotation in rotations for _ in movements] + [0]
+action_movement = [movement for _ in rotations for movement in movements] + [0]
+action_rotation = np.array([rotation for rotation in rotations for _ in movements] + [0])
+action_movements = np.array(action_movement)
+
+# observation: left, front and right sensors, location, heading index, run
+observation_size = 7
+
+# moves in every heading, indexed as `headings`
+moves = [heading_move[heading] for heading in headings]
+
+
+def encode_action(rotation, movement):
+    """
+    Returns action code of the robot's move, as returned by `next_move`.
+    """
+
+    if (rotation, movement) == ('Reset', 'Reset'):
+        return reset_action
+    movement = max(min(int(movement), max_movement), -max_movement)
+    return rotations.index(rotation) * len(movements) + movement + max_movement
+
+
+class Environment(object):
+    """
+    Reset/step interface to a trial under the tester rules.
+
+    An episode is a trial on a maze drawn from the corpus: the first run,
+    a reset action accepted after the goal has been hit, and the second run
+    which ends the episode on entering the goal. The episode also ends when
+    `max_time` time steps are used. Every time step is rewarded with minus
+    its cost in score, `train_score_ratio` on the first run and 1 on the
+    second, so rewards of a completed episode sum to minus its score.
+    `failure_reward` is added when the time is exhausted.
+
+    Mazes are drawn with a random generator seeded by `seed`, so a sequence
+    of episodes is reproducible.
+    """
+
+    def __init__(self, mazes, max_time=max_time, seed=None, failure_reward=0.):
+        self.mazes = mazes
+        self.max_time = max_time
+        self.failure_reward = failure_reward
+        self.seed(seed)
+        self.maze = None
+
+    def seed(self, seed=None):
+        """
+        Seeds the generator used to draw mazes.
+        """
+
+        self.rng = np.random.RandomState(seed)
+
+    def reset(self, index=None):
+        """
+        Starts an episode on the maze with the given index in the corpus,
+        or on a random one. Returns the first observation.
+        """
+
+        if index is None:
+            index = self.rng.randint(len(self.mazes))
+        self.maze = self.mazes[index]
+        self.runs = self.maze.runs
+        self.goal_bounds = (self.maze.dim / 2 - 1, self.maze.dim / 2)
+
+        self.x, self.y, self.heading = 0, 0, 0
+        self.run = 0
+        self.time = 0
+        self.runtimes = [0, 0]
+        self.hit_goal = False
+        self.done = False
+
+        return self.observe()
+
+    def observe(self):
+        x, y, heading, runs = self.x, self.y, self.heading, self.runs
+        return np.array([runs.item(x, y, (heading - 1) % 4), runs.item(x, y, heading),
+                         runs.item(x, y, (heading + 1) % 4), x, y, heading, self.run])
+
+    def step(self, action):
+        """
+        Performs an action and returns observation, reward, done and info.
+        Info of the last step holds `score` (None if the task is not
+        completed), `runtimes` and used time `steps`.
+        """
+
+        if self.done:
+            raise Exception('Episode is done, call reset first!')
+
+        self.time += 1
+        reward = -1. if self.run else -train_score_ratio
+
+        if action == reset_action:
+            # reset is accepted on the first run after the goal has been hit
+            if self.run == 0 and self.hit_goal:
+                self.runtimes[0] = self.time
+                self.run = 1
+                self.x, self.y, self.heading = 0, 0, 0
+                self.hit_goal = False
+        else:
+            heading = self.heading = (self.heading + action_turn[action]) % 4
+            movement = action_movement[action]
+            if movement < 0:
+                heading = (heading + 2) % 4
+                movement = -movement
+            distance = min(movement, self.runs.item(self.x, self.y, heading))
+            self.x += distance * moves[heading][0]
+            self.y += distance * moves[heading][1]
+
+            low, high = self.goal_bounds
+            if low <= self.x <= high and low <= self.y <= high:
+                self.hit_goal = True
+                if self.run:
+                    self.runtimes[1] = self.time - self.runtimes[0]
+                    self.done = True
+
+        info = {}
+        if not self.done and self.time >= self.max_time:
+            self.done = True
+            reward += self.failure_reward
+        if self.done:
+            info['score'] = self.runtimes[1] + train_score_ratio * self.runtimes[0] if self.runtimes[1] else None
+            info['runtimes'] = list(self.runtimes)
+            info['steps'] = self.time
+
+        return self.observe(), reward, self.done, info
+
+
+class VectorEnvironment(object):
+    """
+    N environments stepped at once over vecsim.Lanes; all mazes of the
+    corpus must have the same dimensions. Actions, observations (N, 7),
+    rewards and done flags are arrays. Finished lanes are started again on
+    a newly drawn maze at once, so the returned observation of a finished
+    lane is the first one of its next episode; `score` (NaN if the task is
+    not completed) and `steps` of finished episodes are given in info.
+    """
+
+    def __init__(self, mazes, size, max_time=max_time, seed=None, failure_reward=0.):
+        self.mazes = mazes
+        self.size = size
+        self.max_time = max_time
+        self.failure_reward = failure_reward
+        self.seed(seed)
+        self.lanes = Lanes([mazes[i] for i in self.draw(size)], max_time)
+
+    def seed(self, seed=None):
+        """
+        Seeds the generator used to draw mazes.
+        """
+
+        self.rng = np.random.RandomState(seed)
+
+    def draw(self, count):
+        return self.rng.randint(len(self.mazes), size=count)
+
+    def reset(self):
+        """
+        Starts episodes on newly drawn mazes in every lane. Returns
+        observations.
+        """
+
+        for lane, index in enumerate(self.draw(self.size)):
+            self.lanes.load(lane, self.mazes[index])
+        self.lanes.reset()
+        return self.observe()
+
+    def observe(self):
+        lanes = self.lanes
+        observation = np.empty((self.size, observation_size), dtype=int)
+        observation[:, :3] = lanes.sense()
+        observation[:, 3:5] = lanes.location
+        observation[:, 5] = lanes.heading
+        observation[:, 6] = lanes.run
+        return observation
+
+    def step(self, actions):
+        """
+        Performs (N,) array of actions, returns observations, rewards,
+        done flags and info.
+        """
+
+        lanes = self.lanes
+        actions = np.asarray(actions)
+        reward = np.where(lanes.run == 1, -1., -train_score_ratio)
+        lanes.step(action_rotation[actions], action_movements[actions], actions == reset_action)
+
+        expired = ~lanes.done & (lanes.time >= self.max_time)
+        reward[expired] += self.failure_reward
+        lanes.done |= expired
+        done = lanes.done.copy()
+
+        info = {}
+        if done.any():
+            info['score'] = lanes.scores()[done]
+            info['steps'] = lanes.time[done]
+            info['lanes'] = np.flatnonzero(done)
+            for lane, index in zip(info['lanes'], self.draw(done.sum())):
+                lanes.load(lane, self.mazes[index])
+            lanes.reset(done)
+
+        return self.observe(), reward, done, info
+
+
+if __name__ == '__main__':
+    '''
+    This script measures throughput of the environments with random actions.
+    '''
+
+    from generator import generate
+
+    parser = argparse.ArgumentParser(description='Measure environment throughput with random actions.')
+    parser.add_argument('-n', '--size', type=int, default=1024, help='number of lanes of the vectorized environment')
+    parser.add_argument('-d', '--dim', type=int, default=16, help='dimensions of generated mazes')
+    parser.add_argument('-m', '--mazes', type=int, default=100, help='number of generated mazes')
+    parser.add_argument('--steps', type=int, default=200, help='steps of the vectorized environment')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed')
+    args = parser.parse_args()
+
+    mazes = [generate(args.dim, 'apec', seed) for seed in range(args.mazes)]
+    rng = np.random.RandomState(args.seed)
+
+    env = Environment(mazes, seed=args.seed)
+    env.reset()
+    actions = rng.randint(action_count, size=args.steps * 100)
+    start = time.time()
+    for action in actions:
+        _, _, done, _ = env.step(action)
+        if done:
+            env.reset()
+    print 'Environment: {:.0f} steps per second'.format(len(actions) / (time.time() - start))
+
+    vector_env = VectorEnvironment(mazes, args.size, seed=args.seed)
+    vector_env.reset()
+    actions = rng.randint(action_count, size=(args.steps, args.size))
+    start = time.time()
+    for step_actions in actions:
+        vector_env.step(step_actions)
+    print 'VectorEnvironment: {:.0f} steps per second'.format(actions.size / (time.time() - start))
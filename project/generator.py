@@ -0,0 +1,142 @@
+import argparse
+import os
+import random
+import numpy as np
+from maze import Maze
+
+# perfect - every two cells are connected by exactly one path
+# loopy - perfect maze with a share of walls removed
+# apec - loopy maze with a 2x2 goal room in the center and a single entrance to it
+topologies = ['perfect', 'loopy', 'apec']
+
+
+def generate_walls(dim, topology='apec', seed=None, loops=0.1):
+    """
+    Generates (dim, dim) array of walls coded as 4-bit numbers, as in maze
+    files. The start cell always has a wall on its right side and an opening
+    on its top side. `loops` is a share of remaining walls removed from
+    loopy and apec mazes. Mazes are reproducible for the same seed.
+    """
+
+    if dim < 2 or dim % 2:
+        raise Exception('Maze dimensions must be even in length!')
+    if topology not in topologies:
+        raise Exception('Unknown maze topology: {}'.format(topology))
+    if topology == 'apec' and dim < 4:
+        raise Exception('Maze with a goal room must be at least 4 cells long!')
+
+    rng = random.Random(seed)
+
+    # passages between (x, y) and (x, y + 1) and between (x, y) and (x + 1, y)
+    open_up = np.zeros((dim, dim), dtype=bool)
+    open_right = np.zeros((dim, dim), dtype=bool)
+
+    # walls which are never removed: start cell's right wall and goal room borders
+    fixed_up = np.zeros((dim, dim), dtype=bool)
+    fixed_right = np.zeros((dim, dim), dtype=bool)
+    fixed_right[0, 0] = True
+
+    # goal room cells are excluded from carving
+    carved = bytearray(dim * dim)
+    room = [dim / 2 - 1, dim / 2]
+    if topology == 'apec':
+        for x in room:
+            for y in room:
+                carved[x * dim + y] = 1
+        fixed_up[room[0]:room[1] + 1, room[1]] = True
+        fixed_up[room[0]:room[1] + 1, room[0] - 1] = True
+        fixed_right[room[1], room[0]:room[1] + 1] = True
+        fixed_right[room[0] - 1, room[0]:room[1] + 1] = True
+
+    # carve a spanning tree with iterative randomized depth-first search; the
+    # start cell is only connected to the cell above it and never revisited
+    carved[0] = carved[1] = 1
+    open_up[0, 0] = True
+    rest = [(0, 1)]
+    while len(rest) > 0:
+        x, y = rest[-1]
+        options = []
+        if y + 1 < dim and not carved[x * dim + y + 1]:
+            options.append((x, y + 1))
+        if x + 1 < dim and not carved[(x + 1) * dim + y]:
+            options.append((x + 1, y))
+        if y > 0 and not carved[x * dim + y - 1]:
+            options.append((x, y - 1))
+        if x > 0 and not carved[(x - 1) * dim + y]:
+            options.append((x - 1, y))
+        if not options:
+            rest.pop()
+            continue
+        x2, y2 = options[int(rng.random() * len(options))]
+        carved[x2 * dim + y2] = 1
+        if x2 != x:
+            open_right[min(x, x2), y] = True
+        else:
+            open_up[x, min(y, y2)] = True
+        rest.append((x2, y2))
+
+    if topology != 'perfect':
+        # remove random internal walls to create loops
+        noise = np.random.RandomState(rng.randint(0, 2 ** 31 - 1))
+        open_up[:, :-1] |= (noise.random_sample((dim, dim - 1)) < loops) & ~fixed_up[:, :-1]
+        open_right[:-1, :] |= (noise.random_sample((dim - 1, dim)) < loops) & ~fixed_right[:-1, :]
+
+    if topology == 'apec':
+        # open the goal room inside and make a single entrance
+        open_up[room[0]:room[1] + 1, room[0]] = True
+        open_right[room[0], room[0]:room[1] + 1] = True
+        entrances = [(open_up, i, room[1]) for i in room] + [(open_up, i, room[0] - 1) for i in room] + \
+                    [(open_right, room[1], i) for i in room] + [(open_right, room[0] - 1, i) for i in room]
+        passages, x, y = rng.choice(entrances)
+        passages[x, y] = True
+
+    walls = np.zeros((dim, dim), dtype=int)
+    walls += open_up * 1
+    walls += open_right * 2
+    walls[:, 1:] += open_up[:, :-1] * 4
+    walls[1:, :] += open_right[:-1, :] * 8
+
+    return walls
+
+
+def generate(dim, topology='apec', seed=None, loops=0.1):
+    """
+    Generates a maze, see `generate_walls`.
+    """
+
+    name = '{}_{}_{}'.format(topology, dim, seed)
+    return Maze(name, generate_walls(dim, topology, seed, loops))
+
+
+def write_maze(filename, walls):
+    """
+    Writes walls to a file in the maze file format.
+    """
+
+    with open(filename, 'wb') as f_out:
+        f_out.write('{}\n'.format(len(walls)))
+        for column in walls:
+            f_out.write(','.join(str(cell) for cell in column) + '\n')
+
+
+if __name__ == '__main__':
+    '''
+    This script writes generated mazes to the given directory.
+    '''
+
+    parser = argparse.ArgumentParser(description='Generate maze files.')
+    parser.add_argument('dim', type=int, help='maze dimensions, even number')
+    parser.add_argument('-t', '--topology', choices=topologies, default='apec', help='maze topology')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the first maze')
+    parser.add_argument('-n', '--number', type=int, default=1, help='number of mazes')
+    parser.add_argument('-l', '--loops', type=float, default=0.1, help='share of walls removed to create loops')
+    parser.add_argument('-o', '--output', default='.', help='output directory')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    for seed in range(args.seed, args.seed + args.number):
+        filename = os.path.join(args.output, '{}_{}_{:03d}.txt'.format(args.topology, args.dim, seed))
+        write_maze(filename, generate_walls(args.dim, args.topology, seed, args.loops))
+        print filename
@@ -0,0 +1,51 @@
+import hashlib
+import os
+import numpy as np
+from policy import policy_arrays, wavefront_policy
+
+
+def maze_key(maze):
+    """
+    Returns hash of the maze dimensions and walls, which names files
+    with knowledge learned in the maze.
+    """
+
+    walls = np.ascontiguousarray(maze.walls, dtype=np.uint8)
+    return hashlib.sha1('{}:'.format(maze.dim) + walls.tostring()).hexdigest()[:16]
+
+
+def knowledge_filename(directory, maze):
+    """
+    Returns name of the file with knowledge learned in the maze.
+    """
+
+    return os.path.join(directory, maze_key(maze) + '.npz')
+
+
+def save_knowledge(filename, robot):
+    """
+    Writes walls learned by the robot, as known and wall grids of its Maze,
+    and its policy to a compressed NumPy archive. The file is written under
+    a temporary name first, so readers never see partial data.
+    """
+
+    value, heading, movement = policy_arrays(robot.policy)
+    temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temp_filename, 'wb') as f_out:
+        np.savez_compressed(f_out, known=robot.maze.known_grid, wall=robot.maze.wall_grid,
+                            version=robot.maze.version, value=value, heading=heading, movement=movement)
+    os.rename(temp_filename, filename)
+
+
+def load_knowledge(filename, robot):
+    """
+    Restores walls and policy saved by `save_knowledge` to the robot,
+    which must be placed in a maze of the same dimensions.
+    """
+
+    data = np.load(filename)
+    if data['known'].shape != robot.maze.known_grid.shape:
+        raise Exception('Knowledge was learned in a maze of other dimensions!')
+
+    policy = wavefront_policy(data['value'], data['heading'], data['movement'])
+    robot.restore(data['known'], data['wall'], int(data['version']), policy)
@@ -1,8 +1,17 @@
+import os
 import numpy as np
 
+directions = ['up', 'right', 'down', 'left']
+
+dir_int = {'up': 1, 'right': 2, 'down': 4, 'left': 8}
+
+dir_index = {'up': 0, 'right': 1, 'down': 2, 'left': 3}
+
+dir_move = {'up': [0, 1], 'right': [1, 0], 'down': [0, -1], 'left': [-1, 0]}
+
 
 class Maze(object):
-    def __init__(self, filename):
+    def __init__(self, filename, walls=None, cache=False):
         """
         Maze objects have two main attributes:
         - dim: mazes should be square, with sides of even length. (integer)
@@ -13,41 +22,87 @@ class Maze(object):
             array)
 
         The initialization function also performs some consistency checks for
-        wall positioning.
+        wall positioning. If `walls` array is given it's used instead of
+        reading the file, filename then only names the maze.
+
+        If `cache` is set, walls of a validated maze are saved next to the
+        file in NumPy format (filename + '.npy') and loaded from there, without
+        parsing and validation, while the cache is newer than the file.
         """
 
         self.filename = filename
 
-        with open(filename, 'rb') as f_in:
+        if walls is not None:
+            self.walls = np.array(walls)
+            self.dim = len(self.walls)
+            self.validate()
+        elif cache and self.is_cached():
+            self.walls = np.load(self.cache_filename()).astype(int)
+            self.dim = len(self.walls)
+        else:
+            with open(filename, 'rb') as f_in:
 
-            # first line should be an integer with the maze dimensions
-            self.dim = int(f_in.next())
+                # first line should be an integer with the maze dimensions
+                self.dim = int(f_in.readline())
 
-            # subsequent lines describe the permissability of walls
-            walls = []
-            for line in f_in:
-                walls.append(map(int, line.split(',')))
-            self.walls = np.array(walls)
+                # subsequent lines describe the permissability of walls
+                lines = [line for line in f_in.read().splitlines() if line.strip()]
+                walls = np.fromstring(','.join(lines), dtype=int, sep=',')
+                if len(lines) == self.dim and all(line.count(',') == self.dim - 1 for line in lines):
+                    walls = walls.reshape(len(lines), -1)
+                self.walls = walls
+
+            self.validate()
+            if cache:
+                self.write_cache()
+
+        # number of open cells to the nearest wall from every cell in every
+        # direction, indexed as `directions`
+        self.runs = self.compute_runs()
+
+    def compute_runs(self):
+        """
+        Computes (dim, dim, 4) array of open run lengths for every cell
+        and direction. Runs are accumulated line by line starting from
+        the far side of the maze.
+        """
+
+        runs = np.zeros((self.dim, self.dim, len(directions)), dtype=np.int32)
+        for d, direction in enumerate(directions):
+            permissible = self.permissible_mask(direction)
+            run = runs[:, :, d]
+            move = dir_move[direction]
+            if move[1]:
+                # iterate over the first axis for both orientations
+                permissible, run = permissible.T, run.T
+            lines = range(self.dim)
+            if move[0] + move[1] > 0:
+                lines.reverse()
+            previous = np.zeros(self.dim, dtype=np.int32)
+            for i in lines:
+                run[i] = np.where(permissible[i], previous + 1, 0)
+                previous = run[i]
+
+        return runs
+
+    def validate(self):
+        """
+        Checks maze dimensions and that every wall is specified the same way
+        for both cells it separates. Inconsistent walls are printed before
+        the exception is raised.
+        """
 
-        # perform validation on maze
         # maze dimensions
         if self.dim % 2:
             raise Exception('Maze dimensions must be even in length!')
         if self.walls.shape != (self.dim, self.dim):
             raise Exception('Maze shape does not match dimension attribute!')
 
-        # wall permeability
-        wall_errors = []
-        # vertical walls
-        for x in range(self.dim - 1):
-            for y in range(self.dim):
-                if (self.walls[x, y] & 2 != 0) != (self.walls[x + 1, y] & 8 != 0):
-                    wall_errors.append([(x, y), 'v'])
-        # horizontal walls
-        for y in range(self.dim - 1):
-            for x in range(self.dim):
-                if (self.walls[x, y] & 1 != 0) != (self.walls[x, y + 1] & 4 != 0):
-                    wall_errors.append([(x, y), 'h'])
+        # wall permeability, comparing every cell with its right and top neighbour
+        vertical = (self.walls[:-1, :] & 2 != 0) != (self.walls[1:, :] & 8 != 0)
+        horizontal = (self.walls[:, :-1] & 1 != 0) != (self.walls[:, 1:] & 4 != 0)
+        wall_errors = [[(x, y), 'v'] for x, y in np.argwhere(vertical).tolist()] + \
+                      [[(x, y), 'h'] for y, x in np.argwhere(horizontal.T).tolist()]
 
         if wall_errors:
             for cell, wall_type in wall_errors:
@@ -59,6 +114,39 @@ class Maze(object):
                     print 'Inconsistent horizontal wall between {} and {}'.format(cell, cell2)
             raise Exception('Consistency errors found in wall specifications!')
 
+    def cache_filename(self):
+        """
+        Returns name of the file with cached walls.
+        """
+
+        return self.filename + '.npy'
+
+    def is_cached(self):
+        """
+        Checks if cached walls exist and are newer than the maze file.
+        """
+
+        try:
+            return os.path.getmtime(self.cache_filename()) >= os.path.getmtime(self.filename)
+        except OSError:
+            return False
+
+    def write_cache(self):
+        """
+        Saves walls next to the maze file. The file is written under a
+        temporary name first, so concurrent readers never see partial data.
+        Failures are ignored, the maze is parsed again next time.
+        """
+
+        temp_filename = '{}.{}.tmp'.format(self.cache_filename(), os.getpid())
+        try:
+            with open(temp_filename, 'wb') as f_out:
+                np.save(f_out, self.walls.astype(np.uint8))
+            os.rename(temp_filename, self.cache_filename())
+        except (IOError, OSError):
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
     def is_permissible(self, cell, direction):
         """
         Returns a boolean designating whether or not a cell is passable in the
@@ -66,12 +154,22 @@ class Maze(object):
         complete words 'up', 'right', 'down', 'left'.
         """
 
-        dir_int = {'up': 1, 'right': 2, 'down': 4, 'left': 8}
         try:
             return self.walls[tuple(cell)] & dir_int[direction] != 0
         except Exception as e:
             print 'Invalid direction provided!.\n{}: {}'.format(e.__class__.__name__, e)
 
+    def permissible_mask(self, direction):
+        """
+        Returns (dim, dim) boolean array designating whether or not every
+        cell is passable in the given direction, a complete word or an
+        index of `directions`.
+        """
+
+        if not isinstance(direction, basestring):
+            direction = directions[direction]
+        return self.walls & dir_int[direction] != 0
+
     def dist_to_wall(self, cell, direction):
         """
         Returns a number designating the number of open cells to the nearest
@@ -79,16 +177,20 @@ class Maze(object):
         must be input as complete words 'up', 'right', 'down', 'left'.
         """
 
-        dir_move = {'up': [0, 1], 'right': [1, 0], 'down': [0, -1], 'left': [-1, 0]}
+        return self.runs.item(cell[0], cell[1], dir_index[direction])
+
+    def sense(self, cells, headings):
+        """
+        Returns (N, 3) array of sensor readings, distances from the left,
+        front and right-facing sensors, for N robot positions at once.
+        Cells are input as (N, 2) array, headings as N complete words or
+        N indices of `directions`.
+        """
+
+        cells = np.asarray(cells)
+        headings = np.asarray(headings)
+        if headings.dtype.kind in 'SU':
+            headings = np.array([dir_index[heading] for heading in headings])
 
-        sensing = True
-        distance = 0
-        curr_cell = list(cell)  # make copy to preserve original
-        while sensing:
-            if self.is_permissible(curr_cell, direction):
-                distance += 1
-                curr_cell[0] += dir_move[direction][0]
-                curr_cell[1] += dir_move[direction][1]
-            else:
-                sensing = False
-        return distance
+        sensors = (headings[:, None] + [-1, 0, 1]) % len(directions)
+        return self.runs[cells[:, 0, None], cells[:, 1, None], sensors]
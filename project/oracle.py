@@ -0,0 +1,792 @@
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+from collections import namedtuple
+from knowledge import maze_key
+from maze import Maze, dir_int, directions
+from policy import compute_policy, heading_moves, heading_reverses, heading_rotations, max_movement, unreachable
+from tester import max_time, train_score_ratio
+
+# states expanded by the search before it settles for a lower bound
+default_budget = 20000
+
+# groups of walls of routes faster than optimal told apart by the estimate
+max_groups = 32
+
+# targets far from each other which the estimate visits in the best order
+max_tour = 6
+
+# walks kept by the beam search for a proving walk, and states each walk
+# goes on to
+certify_width = 16
+certify_branches = 4
+
+# share of the time limit of `solve` left to the beam search, the rest is
+# kept for the search
+certify_share = 0.25
+
+# the search counts first run time steps, a second run step costs
+# `time_scale` of them
+time_scale = int(round(1 / train_score_ratio))
+
+# outcome of the oracle: best achievable score (None if not proven within
+# the budget), its lower bound (equal to the score if proven), an achievable
+# score (the proven one, of the best walk found or the given bound, None if
+# none), number of expanded states and the budget
+OracleResult = namedtuple('OracleResult', ['score', 'lower_bound', 'upper_bound', 'nodes', 'budget'])
+
+
+class Oracle(object):
+    """
+    Search for the best score achievable on a known maze under the tester
+    rules by a robot which doesn't know it and resets only once it has
+    proven its route optimal.
+
+    The robot learns edges only by its sensors: after every move, rays from
+    its cell to the left, front and right up to the nearest wall. The first
+    run ends with a reset, which takes a time step, once the goal has been
+    entered and the learned edges prove the route optimal: a route over
+    edges sensed open is as fast as the optimal one and no route over edges
+    not sensed as walls is faster. The second run then takes the optimal
+    time, so the search minimizes first run time steps. Without the proof
+    any robot could reset after walking the optimal route by luck, which is
+    what the best score of `estimate_score` assumes.
+
+    A state of the search is the robot's cell, heading, whether the goal
+    has been entered and the learned edges. Only edges which can take part
+    in the proof are kept: openings of optimal routes and walls of routes
+    faster than the optimal one in the maze with no inner walls. Learned
+    edges are also made canonical: once an optimal route is verified every
+    kept opening is set, and walls left on no faster route are set, so
+    states which can go on to the same proofs are merged. States are
+    expanded in order of time steps taken plus an admissible estimate of the
+    rest, the time of the shortest walk which enters the goal and senses an
+    edge of every target: every opening crossed by all optimal routes and a
+    wall of each of a few disjoint faster routes. It is bounded by the
+    nearest target plus a spanning tree over targets, by the best order of
+    a few targets far from each other and by every target on the way to the
+    goal. A state is dropped if a state in the same cell with the same
+    heading has learned a superset of its edges in no more time steps.
+
+    Before the search a beam search finds walks which prove a route, each
+    going to the nearest states which sense a target, so the search only
+    looks for strictly shorter ones and proves the best of them optimal if
+    it runs out of states. Out of budget or time, the search settles for
+    the highest estimate it has expanded as a lower bound.
+
+    The oracle is a bounds estimator: exact scores are proven within the
+    default budget on small mazes, 8x8 and some 10x10 ones, while on 12x12
+    to 16x16 mazes it returns the lower bound and the best walk found.
+
+    Learned edges are a bit mask: for every heading, bits of cells which
+    edge in that heading is known, shifted by heading index times number
+    of cells.
+    """
+
+    def __init__(self, maze, upper=None):
+        dim = self.dim = maze.dim
+        size = self.size = dim * dim
+        goal_bounds = [dim / 2 - 1, dim / 2]
+        goals = [[x, y] for x in goal_bounds for y in goal_bounds]
+        self.is_goal = [x in goal_bounds and y in goal_bounds for x in range(dim) for y in range(dim)]
+        self.goal = sum(1 << (x * dim + y) for x, y in goals)
+        self.runs = [[maze.runs.item(x, y, direction) for direction in range(len(directions))]
+                     for x in range(dim) for y in range(dim)]
+        steps = self.steps = [move[0] * dim + move[1] for move in heading_moves]
+        self.full = (1 << size) - 1
+
+        # cells which edge in every heading is inner (not a border), open and
+        # an inner wall
+        empty_walls = np.full((dim, dim), 15, dtype=int)
+        empty_walls[:, -1] &= ~dir_int['up']
+        empty_walls[-1, :] &= ~dir_int['right']
+        empty_walls[:, 0] &= ~dir_int['down']
+        empty_walls[0, :] &= ~dir_int['left']
+        empty = Maze('empty', walls=empty_walls)
+        self.inner = [self.bits(np.flatnonzero(empty_walls & dir_int[direction]).tolist())
+                      for direction in directions]
+        self.open = [self.bits(np.flatnonzero(maze.walls & dir_int[direction]).tolist())
+                     for direction in directions]
+        self.wall = [inner & ~opened for inner, opened in zip(self.inner, self.open)]
+
+        # time steps to enter the goal and to reach every cell from the init
+        # point, in the maze and with no inner walls
+        self.to_goal = compute_policy(maze, goals).time
+        from_init = compute_policy(maze, [[0, 0]]).time
+        empty_to_goal = compute_policy(empty, goals).time
+        empty_from_init = compute_policy(empty, [[0, 0]]).time
+        self.best_time = self.to_goal[0]
+
+        # kept edges: openings of moves on optimal routes and walls of moves
+        # on faster routes with no inner walls
+        kept = 0
+        for cell in range(size):
+            for direction in range(len(directions)):
+                for i in range(1, max_movement + 1):
+                    cell2 = cell + i * steps[direction]
+                    if not self.inner[direction] >> (cell2 - steps[direction]) & 1:
+                        break
+                    if i <= self.runs[cell][direction]:
+                        if from_init[cell] + 1 + self.to_goal[cell2] == self.best_time:
+                            for j in range(i):
+                                kept |= self.edge_bits(cell + j * steps[direction], direction)
+                    elif empty_from_init[cell] + 1 + empty_to_goal[cell2] < self.best_time:
+                        for j in range(self.runs[cell][direction], i):
+                            if self.wall[direction] >> (cell + j * steps[direction]) & 1:
+                                kept |= self.edge_bits(cell + j * steps[direction], direction)
+        self.kept = kept
+        self.kept_open = sum(1 << bit for bit in self.bit_list(kept) if self.open[bit // size] >> (bit % size) & 1)
+        self.kept_walls = kept & ~self.kept_open
+
+        # kept edges sensed from every cell in every heading, and time steps
+        # to reach a cell from which every kept edge is sensed
+        sensed = {}
+        rays = []
+        for cell in range(size):
+            for direction in range(len(directions)):
+                mask = 0
+                for i in range(self.runs[cell][direction] + 1):
+                    cell2 = cell + i * steps[direction]
+                    if self.inner[direction] >> cell2 & 1:
+                        edge_bits = self.edge_bits(cell2, direction) & kept
+                        if edge_bits:
+                            mask |= edge_bits
+                            sensed.setdefault(edge_bits, []).append(list(divmod(cell, dim)))
+                rays.append(mask)
+        self.sense = [rays[cell * 4 + sensor] | rays[cell * 4 + heading] | rays[cell * 4 + (heading + 1) % 4]
+                      for cell in range(size) for heading in range(len(directions))
+                      for sensor in [(heading - 1) % 4]]
+
+        # time steps to reach a cell from which a kept edge is sensed, and
+        # then the goal, from every cell, as rows of arrays; the goal is the
+        # last row
+        self.neighbours = [[cell + i * steps[direction] for direction in range(len(directions))
+                            for i in range(1, min(max_movement, self.runs[cell][direction]) + 1)]
+                           for cell in range(size)]
+        self.sense_rows = {}
+        times, through = [], []
+        for edge_bits, cells in sensed.items():
+            cells = [x * dim + y for x, y in cells]
+            for bit in self.bit_list(edge_bits):
+                self.sense_rows[bit] = len(times)
+            times.append(self.times_from([(0, cell) for cell in cells]))
+            through.append(self.times_from([(self.to_goal[cell], cell) for cell in cells]))
+        times.append(self.to_goal.tolist())
+        through.append(self.to_goal.tolist())
+        self.sense_times = np.array(times, dtype=np.int64)
+        self.through_times = np.array(through, dtype=np.int64)
+        self.goal_cells = [x * dim + y for x, y in goals]
+
+        # time steps between the nearest cells of every two rows
+        self.row_distance = np.array([self.sense_times[:, np.flatnonzero(row == 0)].min(axis=1)
+                                      for row in self.sense_times])
+
+        # kept openings crossed by every optimal route
+        self.mandatory = 0
+        for bit in self.bit_list(self.kept_open):
+            edge = self.edge_bits(bit % size, bit // size)
+            if not self.mandatory & edge and not self.verifies(self.kept_open & ~edge):
+                self.mandatory |= edge
+
+        # bound of first run time steps, reset included
+        self.upper = max_time - self.best_time
+        if upper is not None:
+            self.upper = min(self.upper, int(round(upper * time_scale)) - time_scale * self.best_time)
+        self.given_upper = upper
+        self.given_steps = self.upper
+        self.certified = None
+        self.opening_memo = {}
+        self.wall_memo = {}
+        self.plans = {}
+
+    def bits(self, cells):
+        return sum(1 << cell for cell in cells)
+
+    def times_from(self, seeds):
+        """
+        Returns time steps to reach every cell from any of the seed cells,
+        given as (time, cell) with time steps taken to reach the seed.
+        """
+
+        times = [unreachable] * self.size
+        for steps, cell in seeds:
+            times[cell] = min(times[cell], steps)
+        rest = list(seeds)
+        heapq.heapify(rest)
+        while rest:
+            steps, cell = heapq.heappop(rest)
+            if steps > times[cell]:
+                continue
+            for cell2 in self.neighbours[cell]:
+                if steps + 1 < times[cell2]:
+                    times[cell2] = steps + 1
+                    heapq.heappush(rest, (steps + 1, cell2))
+        return times
+
+    def bit_list(self, mask):
+        """
+        Returns positions of set bits of the mask.
+        """
+
+        bits = []
+        while mask:
+            low = mask & -mask
+            bits.append(low.bit_length() - 1)
+            mask ^= low
+        return bits
+
+    def edge_bits(self, cell, direction):
+        """
+        Returns bits of the edge of the cell in the heading, from both sides.
+        """
+
+        reverse = heading_reverses[direction]
+        return 1 << (direction * self.size + cell) | 1 << (reverse * self.size + cell + self.steps[direction])
+
+    def spread(self, start, passable, limit, target=0):
+        """
+        Returns masks of cells first reached from the start cells in 0, 1...
+        time steps over passable edges (masks of cells per heading), up to
+        `limit` time steps or until a target cell is reached.
+        """
+
+        layers = [start]
+        seen = frontier = start
+        while frontier and len(layers) <= limit and not frontier & target:
+            reached = 0
+            for step, cells_passable in zip(self.steps, passable):
+                cells = frontier
+                for i in range(max_movement):
+                    # a step moves bits of cells by the index offset
+                    cells &= cells_passable
+                    cells = cells << step if step > 0 else cells >> -step
+                    if not cells:
+                        break
+                    reached |= cells
+            frontier = reached & ~seen
+            seen |= frontier
+            layers.append(frontier)
+        return layers
+
+    def cells(self, mask):
+        """
+        Returns masks of cells per heading from a mask of edge bits.
+        """
+
+        return [mask >> (direction * self.size) & self.full for direction in range(len(directions))]
+
+    def verifies(self, known):
+        """
+        Checks if a route over learned openings is optimal.
+        """
+
+        passable = [cells & opened for cells, opened in zip(self.cells(known), self.open)]
+        return bool(self.spread(1, passable, self.best_time, self.goal)[-1] & self.goal)
+
+    def target(self, bits):
+        """
+        Returns a target of the estimate: mask of the edge bits, one of
+        which must be learned, and sensing rows of the edges.
+        """
+
+        return sum(1 << bit for bit in bits), sorted(set(self.sense_rows[bit] for bit in bits))
+
+    def opening_targets(self, known):
+        """
+        Returns targets of openings still to learn to prove a route over
+        learned openings optimal: every opening of optimal routes which all
+        of them cross, then any other one if these aren't enough. Memoized
+        by learned openings.
+        """
+
+        key = known & self.kept_open
+        targets = self.opening_memo.get(key)
+        if targets is None:
+            targets = []
+            if not self.verifies(key):
+                missing = self.kept_open & ~key
+                edges = {}
+                for bit in self.bit_list(missing & self.mandatory):
+                    edges.setdefault(self.sense_rows[bit], []).append(bit)
+                targets = [self.target(bits) for _, bits in sorted(edges.items())]
+                if not self.verifies(key | self.mandatory):
+                    targets.append(self.target(self.bit_list(missing & ~self.mandatory)))
+            self.opening_memo[key] = targets
+        return targets
+
+    def wall_targets(self, known, base=None):
+        """
+        Returns walls which can't take part in the proof any more, as a
+        mask of edge bits, and targets of walls of which at least one each
+        must still be learned to prove that no route over edges not known
+        as walls is faster than optimal.
+
+        A wall can take part in the proof if a move across it is on such a
+        faster route. Targets are walls of a single faster route each,
+        found one after another with walls of previous ones blocked,
+        preferring moves across fewer walls. Targets of the `base` learned
+        edges, if given, which have no learned wall are kept, so mostly
+        only a few routes are traced for a new wall. Memoized by learned
+        walls.
+        """
+
+        key = known & self.kept_walls
+        info = self.wall_memo.get(key)
+        if info is not None:
+            return info
+
+        limit = self.best_time - 1
+        passable = [inner & ~(cells & wall) for inner, cells, wall in zip(self.inner, self.cells(key), self.wall)]
+        forward = self.spread(1, passable, limit)
+        backward = self.spread(self.goal, passable, limit)
+        for t in range(1, len(backward)):
+            backward[t] |= backward[t - 1]
+
+        # walls crossed by moves between cells within the time of a faster
+        # route from the init point and to the goal
+        relevant = 0
+        for t in range(min(len(forward), limit)):
+            ends = backward[min(limit - t - 1, len(backward) - 1)]
+            for direction, step in enumerate(self.steps):
+                cells = forward[t]
+                crossed = 0
+                for i in range(1, max_movement + 1):
+                    cells &= passable[direction]
+                    cells = cells << step if step > 0 else cells >> -step
+                    moved = cells & ends
+                    for j in range(i):
+                        moved = moved >> step if step > 0 else moved << -step
+                        crossed |= moved
+                for cell in self.bit_list(crossed & self.wall[direction]):
+                    relevant |= self.edge_bits(cell, direction)
+
+        groups = []
+        if base is not None and relevant:
+            groups = [target for target in self.wall_targets(base)[1] if not target[0] & key]
+        blocked = [self.bit_list(mask) for mask, _ in groups]
+        while len(groups) < max_groups and relevant:
+            for bits in blocked:
+                for bit in bits:
+                    direction, cell = divmod(bit, self.size)
+                    passable[direction] &= ~(1 << cell)
+                    passable[heading_reverses[direction]] &= ~(1 << (cell + self.steps[direction]))
+            layers = self.spread(1, passable, limit, self.goal)
+            if not layers[-1] & self.goal:
+                break
+            blocked = [self.route_walls(layers, passable)]
+            groups.append(self.target(blocked[0]))
+
+        info = (self.kept_walls & ~relevant & ~key, groups)
+        self.wall_memo[key] = self.wall_memo[key | info[0]] = info
+        return info
+
+    def route_walls(self, layers, passable):
+        """
+        Traces a fastest route back from the goal over layers of `spread`
+        and returns walls it crosses, as bit positions. Every move is the
+        one across the fewest walls.
+        """
+
+        cell = (layers[-1] & self.goal).bit_length() - 1
+        walls = []
+        for t in range(len(layers) - 1, 0, -1):
+            best = None
+            for direction, step in enumerate(self.steps):
+                # moves of 1, 2, 3 cells ending in the cell, crossing the
+                # edges of the cells behind it
+                cell2, move_walls = cell, []
+                for i in range(max_movement):
+                    cell2 -= step
+                    if not 0 <= cell2 < self.size or not passable[direction] >> cell2 & 1:
+                        break
+                    if self.wall[direction] >> cell2 & 1:
+                        move_walls = move_walls + [direction * self.size + cell2]
+                    if layers[t - 1] >> cell2 & 1 and (best is None or len(move_walls) < len(best[1])):
+                        best = (cell2, move_walls)
+            cell = best[0]
+            walls.extend(best[1])
+        return walls
+
+    def canonical(self, known, base=None):
+        """
+        Returns learned edges with all kept openings set once a route over
+        learned ones is optimal and with walls which can't take part in the
+        proof set, so states which can only go on the same way are merged.
+        Targets are found from those of the `base` learned edges, if given.
+        """
+
+        if not self.opening_targets(known):
+            known |= self.kept_open
+        return known | self.wall_targets(known, base)[0]
+
+    def plan(self, known, hit):
+        """
+        Returns whether the learned edges prove the route optimal and a
+        lower bound of first run time steps left before the reset from
+        every cell, as a list.
+
+        Targets are cells from which an edge of every target of
+        `opening_targets` and `wall_targets` is sensed, and the goal unless
+        entered. Counting time between targets as between their nearest
+        cells, the bound is the largest of time steps to reach the nearest
+        target plus the minimum spanning tree of targets, of time steps to
+        visit a few targets far from each other in the best order, and of
+        time steps to visit any target along with the goal. Memoized.
+        """
+
+        key = (known, hit)
+        plan = self.plans.get(key)
+        if plan is not None:
+            return plan
+
+        targets = [rows for _, rows in self.opening_targets(known) + self.wall_targets(known)[1]]
+        proven = not targets
+        if not hit:
+            targets.append([len(self.sense_times) - 1])
+        if not targets:
+            plan = self.plans[key] = (proven, [0] * self.size)
+            return plan
+
+        rows = [row for target in targets for row in target]
+        starts = np.cumsum([0] + [len(target) for target in targets[:-1]])
+        times = np.minimum.reduceat(self.sense_times[rows], starts, axis=0)
+        count = len(targets)
+        distance = np.minimum.reduceat(np.minimum.reduceat(self.row_distance[np.ix_(rows, rows)], starts, axis=0),
+                                       starts, axis=1)
+        # minimum spanning tree of targets
+        tree = np.zeros(count, dtype=bool)
+        tree[0] = True
+        nearest = distance[0].copy()
+        length = 0
+        for _ in range(count - 1):
+            target = np.where(tree, unreachable, nearest).argmin()
+            length += nearest[target]
+            tree[target] = True
+            nearest = np.minimum(nearest, distance[target])
+        steps = times.min(axis=0) + length
+
+        # shortest paths over a few targets far from each other, the goal
+        # first, from the last visited one back
+        chosen = [count - 1] if not hit else [int(distance.sum(axis=1).argmax())]
+        apart = distance[chosen[0]].copy()
+        while len(chosen) < min(count, max_tour):
+            target = int(apart.argmax())
+            chosen.append(target)
+            apart = np.minimum(apart, distance[target])
+        distance = distance[np.ix_(chosen, chosen)].tolist()
+        tour = len(chosen)
+        tails = [[0] * tour for _ in range(1 << tour)]
+        for subset in range(1, 1 << tour):
+            for i in range(tour):
+                rest = subset & ~(1 << i)
+                if rest != subset and rest:
+                    tails[subset][i] = min(distance[i][j] + tails[rest][j] for j in range(tour) if rest >> j & 1)
+        steps = np.maximum(steps, (times[chosen] + np.array(tails[-1])[:, None]).min(axis=0))
+
+        # any target and the goal, in either order
+        if not hit:
+            through = np.minimum.reduceat(self.through_times[rows], starts, axis=0)
+            from_goal = times[:, self.goal_cells].min(axis=1)
+            steps = np.maximum(steps, np.minimum(through, self.sense_times[-1] + from_goal[:, None]).max(axis=0))
+
+        plan = self.plans[key] = (proven, np.maximum(steps, 1).tolist())
+        return plan
+
+    def estimate(self, cell, hit, known):
+        """
+        Returns a lower bound of first run time steps left before the
+        reset, see `plan`, and whether the learned edges prove the route
+        optimal.
+        """
+
+        proven, steps = self.plan(known, hit)
+        return steps[cell], proven
+
+    def moves(self, cell, heading):
+        """
+        Yields cells and headings after every move from the state: rotate,
+        then move forwards or backwards; only rotate if not moving.
+        """
+
+        for heading2 in heading_rotations[heading]:
+            for direction in (heading2, heading_reverses[heading2]):
+                for i in range(0 if direction == heading2 and heading2 != heading else 1,
+                               min(max_movement, self.runs[cell][direction]) + 1):
+                    yield cell + i * self.steps[direction], heading2
+
+    def approaches(self, cell, heading, hit, known, count):
+        """
+        Returns up to `count` states in which the learned edges meet one
+        more target of the estimate, each the nearest one for its target,
+        as (time steps, cell, heading, goal entered, learned edges).
+        """
+
+        targets = [mask for mask, _ in self.opening_targets(known) + self.wall_targets(known)[1]]
+        if not hit:
+            targets.append(None)
+        found = []
+        start = cell * 4 + heading
+        states = {start: (hit, known)}
+        frontier = [start]
+        steps = 0
+        while frontier and targets and len(found) < count:
+            steps += 1
+            reached = []
+            for state in frontier:
+                hit, known = states[state]
+                for cell2, heading2 in self.moves(*divmod(state, 4)):
+                    state2 = cell2 * 4 + heading2
+                    if state2 in states:
+                        continue
+                    hit2 = hit or self.is_goal[cell2]
+                    known2 = known | self.sense[state2]
+                    states[state2] = (hit2, known2)
+                    reached.append(state2)
+                    met = [mask for mask in targets if (hit2 if mask is None else mask & known2)]
+                    if met:
+                        targets = [mask for mask in targets if mask not in met]
+                        found.append((steps, cell2, heading2, hit2, known2))
+            frontier = reached
+        return found[:count]
+
+    def walk(self, width, branches, best=None, deadline=None):
+        """
+        Beam search over walks to the nearest states meeting targets of
+        the estimate: only `width` walks with the least time steps plus
+        estimate go on, each to `branches` states, until `deadline` if
+        given. Returns first run time steps of the best walk which proves
+        the route optimal, reset included, or `best` if none is better.
+        """
+
+        known = self.canonical(self.sense[0])
+        beam = [(0, 0, 0, False, known)]
+        while beam:
+            walks = {}
+            for g, cell, heading, hit, known in beam:
+                if deadline is not None and time.time() > deadline:
+                    return best
+                for walked, cell2, heading2, hit2, known2 in self.approaches(cell, heading, hit, known, branches):
+                    known2 = self.canonical(known2, known)
+                    steps, proven = self.estimate(cell2, hit2, known2)
+                    g2 = g + walked
+                    if proven and hit2:
+                        best = min(best, g2 + 1) if best is not None else g2 + 1
+                    elif best is None or g2 + 1 + steps < best:
+                        key = (cell2, heading2, hit2, known2)
+                        if key not in walks or walks[key][1] > g2:
+                            walks[key] = (g2 + steps, g2, cell2, heading2, hit2, known2)
+            beam = [walk[1:] for walk in sorted(walks.values())[:width]]
+        return best
+
+    def certify(self, width=certify_width, branches=certify_branches, time_limit=None):
+        """
+        Finds a walk which proves the route optimal: a greedy one, always to
+        the nearest state meeting a target, then a better one with `walk`
+        for up to `time_limit` seconds. Returns first run time steps of the
+        best walk found, reset included, or None. The search then only looks
+        for better walks.
+        """
+
+        deadline = None if time_limit is None else time.time() + time_limit
+        best = self.walk(width, branches, self.walk(1, 1), deadline)
+        if best is not None and (self.certified is None or best < self.certified):
+            self.certified = best
+            self.upper = min(self.upper, best - 1)
+        return best
+
+    def search(self, budget=default_budget, time_limit=None):
+        """
+        Runs the search, expanding up to `budget` states or for up to
+        `time_limit` seconds. Only walks better than the one found by
+        `certify`, if called before, are searched for; if there are none,
+        that one is the best. Returns OracleResult; if stopped by the time
+        limit, its budget is the number of expanded states.
+        """
+
+        start = time.time()
+        known = self.canonical(self.sense[0])
+        steps, _ = self.estimate(0, False, known)
+        rest = [(steps + 1, 0, 0, 0, False, known)]
+        seen = {}
+        nodes = 0
+        lower = 0
+        while rest:
+            f, g, cell, heading, hit, known = heapq.heappop(rest)
+            if cell < 0:
+                return self.result(f, f, nodes, budget)
+            # every route to a better score goes through a state of the
+            # queue, so the least estimate of the queue is a lower bound
+            lower = max(lower, f)
+            if nodes >= budget:
+                return self.result(None, lower, nodes, budget)
+            if time_limit is not None and nodes % 64 == 0 and time.time() - start > time_limit:
+                return self.result(None, lower, nodes, nodes)
+            nodes += 1
+            g = -g
+
+            for cell2, heading2 in self.moves(cell, heading):
+                hit2 = hit or self.is_goal[cell2]
+                known2 = self.canonical(known | self.sense[cell2 * 4 + heading2], known)
+                if self.is_dominated(seen, cell2, heading2, hit2, g + 1, known2):
+                    continue
+                steps, proven = self.estimate(cell2, hit2, known2)
+                if g + 2 + steps > self.upper:
+                    continue
+                if proven and hit2:
+                    # reset right away
+                    heapq.heappush(rest, (g + 2, -g - 2, -1, 0, True, known2))
+                else:
+                    heapq.heappush(rest, (g + 2 + steps, -g - 1, cell2, heading2, hit2, known2))
+
+        # no state can beat the bound
+        if self.certified is not None and self.upper == self.certified - 1:
+            return self.result(self.certified, self.certified, nodes, budget)
+        return self.result(None, self.upper + 1, nodes, budget)
+
+    def is_dominated(self, seen, cell, heading, hit, g, known):
+        """
+        Checks if a state in the same cell with the same heading has been
+        reached in no more time steps with a superset of learned edges and
+        the goal entered if this one has. Records the state otherwise.
+        """
+
+        for hit2 in (True, False) if not hit else (True,):
+            for g2, known2 in seen.get((cell, heading, hit2), ()):
+                if g2 <= g and known2 | known == known2:
+                    return True
+        # drop states this one dominates
+        states = seen.get((cell, heading, hit), ())
+        states = [(g2, known2) for g2, known2 in states if g2 < g or known2 | known != known]
+        states.append((g, known))
+        seen[(cell, heading, hit)] = states
+        return False
+
+    def result(self, steps, lower, nodes, budget):
+        """
+        Converts first run time steps, reset included, to OracleResult.
+        """
+
+        def score(steps):
+            return self.best_time + float(steps) / time_scale
+
+        if steps is not None:
+            return OracleResult(score(steps), score(lower), score(steps), nodes, budget)
+        if self.certified is not None:
+            return OracleResult(None, score(min(lower, self.certified)), score(self.certified), nodes, budget)
+        # the given score is achieved without a proof if nothing beats it
+        return OracleResult(None, score(lower), self.given_upper if lower <= self.given_steps else None, nodes, budget)
+
+
+def solve(maze, budget=default_budget, upper=None, time_limit=None):
+    """
+    Finds the best achievable score on the maze, or bounds of it if more
+    than `budget` states or `time_limit` seconds are needed. The search is
+    bounded by the best walk found by `Oracle.certify`, which takes up to
+    `certify_share` of the time limit, and by `upper`, a score known to be
+    achievable, such as the robot's one, if given.
+    Returns OracleResult.
+    """
+
+    start = time.time()
+    oracle = Oracle(maze, upper)
+    oracle.certify(time_limit=None if time_limit is None else time_limit * certify_share)
+    if time_limit is not None:
+        time_limit = max(0, time_limit - (time.time() - start))
+    return oracle.search(budget, time_limit)
+
+
+def oracle_filename(directory, maze):
+    """
+    Returns name of the file with the oracle result for the maze.
+    """
+
+    return os.path.join(directory, maze_key(maze) + '.json')
+
+
+def cached_solve(maze, directory, budget=default_budget, upper=None, time_limit=None):
+    """
+    Returns `solve` result for the maze, cached in the directory by a hash
+    of the maze. A proven score is always used. Cached bounds are used if
+    found with the same `upper` or none, unless a larger budget and time
+    limit are given.
+    """
+
+    filename = oracle_filename(directory, maze)
+    if os.path.exists(filename):
+        with open(filename) as f_in:
+            data = json.load(f_in)
+        cached_limit = data.pop('time_limit', None)
+        # results of older versions don't record the bound
+        bounded = 'upper' in data
+        cached_upper = data.pop('upper', None)
+        result = OracleResult(**data)
+        if result.score is not None:
+            return result
+        enough = result.budget >= budget or \
+            cached_limit is not None and time_limit is not None and cached_limit >= time_limit
+        if bounded and cached_upper in (None, upper) and enough:
+            return result
+
+    result = solve(maze, budget, upper, time_limit)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by another worker
+            pass
+    temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temp_filename, 'w') as f_out:
+        data = result._asdict()
+        data['time_limit'] = time_limit
+        data['upper'] = upper
+        json.dump(data, f_out)
+    os.rename(temp_filename, filename)
+
+    return result
+
+
+def evaluate(task):
+    """
+    Solves a single maze file. Task is (filename, budget, time limit in
+    seconds or None, cache directory or None). Returns filename and
+    OracleResult.
+    """
+
+    filename, budget, time_limit, directory = task
+    maze = Maze(filename)
+    if directory:
+        return filename, cached_solve(maze, directory, budget, time_limit=time_limit)
+    return filename, solve(maze, budget, time_limit=time_limit)
+
+
+if __name__ == '__main__':
+    '''
+    This script finds bounds of best achievable scores of mazes in parallel.
+    '''
+
+    from batch import find_mazes
+
+    parser = argparse.ArgumentParser(description='Find bounds of best achievable scores of mazes.')
+    parser.add_argument('mazes', nargs='+', help='maze files, directories or glob patterns')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-b', '--budget', type=int, default=default_budget, help='states expanded per maze')
+    parser.add_argument('-t', '--timeout', type=int, default=None, help='time limit per maze in seconds')
+    parser.add_argument('-c', '--cache', default=None, help='directory to cache results in')
+    args = parser.parse_args()
+
+    pool = multiprocessing.Pool(args.workers)
+    try:
+        tasks = [(filename, args.budget, args.timeout, args.cache) for filename in find_mazes(args.mazes)]
+        for filename, result in pool.imap(evaluate, tasks):
+            if result.score is not None:
+                print '{}: {:4.3f} ({} states)'.format(filename, result.score, result.nodes)
+            else:
+                upper = '?' if result.upper_bound is None else '{:4.3f}'.format(result.upper_bound)
+                print '{}: between {:4.3f} and {} ({} states)'.format(filename, result.lower_bound, upper, result.nodes)
+    finally:
+        pool.close()
+        pool.join()
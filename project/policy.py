@@ -1,3 +1,8 @@
+import heapq
+import numpy as np
+from array import array
+from collections import OrderedDict
+
 max_movement = 3
 
 rotations = [-90, 0, 90]
@@ -17,77 +22,705 @@ heading_rotation = {'up': ['left', 'up', 'right'],
                     'down': ['right', 'down', 'left'],
                     'left': ['down', 'left', 'up']}
 
+# order of headings used to break ties between equally short moves
+headings = ['up', 'right', 'down', 'left']
+
+heading_rank = {'up': 0, 'right': 1, 'down': 2, 'left': 3}
+
+# the same tables for headings coded as indices in `headings`, used by
+# planners and the robot; strings remain for the tester and simulator
+heading_moves = [[0, 1], [1, 0], [0, -1], [-1, 0]]
+
+heading_reverses = [2, 3, 0, 1]
+
+heading_rotations = [[3, 0, 1], [0, 1, 2], [1, 2, 3], [2, 3, 0]]
 
-def compute_policy(maze, goals):
+unreachable = 2 ** 31 - 1
+
+
+def compute_policy(maze, goals, vectorized=False, prune=True):
     """
-    Computes optimal policy to reach the goal, based on current maze data.
+    Computes optimal Policy to reach the goal, based on current maze data.
+    The maze must provide `permissible_mask` for every heading index.
+
+    Among equally fast moves the shorter one is preferred, then the one
+    with lower heading index, so the policy depends on the maze only.
+
+    If the maze prunes cells (see robot's Maze) and `prune` is set, pruned
+    cells get a move only if they reach other cells in one, and the search
+    doesn't continue from them. They are never on a route from the init
+    point, so moves of other cells are the same as without pruning.
+
+    If `vectorized` is set the policy is computed by `compute_wavefront`,
+    otherwise by the reference pure Python search.
     """
 
-    value = [[999 for _ in range(maze.dim)] for _ in range(maze.dim)]
+    if vectorized:
+        return wavefront_policy(*compute_wavefront(maze, goals, prune))
 
-    policy = [[None for _ in range(maze.dim)] for _ in range(maze.dim)]
+    dim = maze.dim
+    policy = Policy(dim)
+    value, heading, movement = policy.time, policy.heading, policy.movement
+    pruned = getattr(maze, 'pruned', None) if prune else None
+    permissible = [maze.permissible_mask(direction).ravel().tolist() for direction in range(len(headings))]
+    steps = [move[0] * dim + move[1] for move in heading_moves]
 
     rest = []
     for goal in goals:
-        rest.append(goal)
-        value[goal[0]][goal[1]] = 0
+        cell = goal[0] * dim + goal[1]
+        rest.append(cell)
+        value[cell] = 0
     while len(rest) > 0:
         cell = rest.pop(0)
-        x, y = cell
-        time = value[x][y]
+        time2 = value[cell] + 1
         # check every direction for the cell
-        for heading, move in heading_move.iteritems():
+        for direction in range(len(headings)):
             i = 1
-            x2, y2 = cell
-            time2 = time + 1
+            cell2 = cell
+            step = steps[direction]
             # move as much as possible before wall is spotted
-            while i <= max_movement and maze.is_permissible((x2, y2), heading):
-                x2 += move[0]
-                y2 += move[1]
-                if time2 < value[x2][y2]:
-                    rest.append((x2, y2))
-                    value[x2][y2] = time2
-                    policy[x2][y2] = [heading_reverse[heading], i, time2]
-                elif time2 == value[x2][y2] and i < policy[x2][y2][1]:
-                    policy[x2][y2] = [heading_reverse[heading], i, time2]
+            reverse = heading_reverses[direction]
+            while i <= max_movement and permissible[direction][cell2]:
+                cell2 += step
+                if time2 < value[cell2]:
+                    if pruned is None or not pruned[cell2]:
+                        rest.append(cell2)
+                    value[cell2] = time2
+                    heading[cell2] = reverse
+                    movement[cell2] = i
+                elif time2 == value[cell2] and is_preferred(policy, cell2, reverse, i):
+                    heading[cell2] = reverse
+                    movement[cell2] = i
                 i += 1
 
     return policy
 
 
+def compute_wavefront(maze, goals, prune=True):
+    """
+    Computes optimal policy to reach the goal with NumPy, growing the
+    wavefront one time step at a time. The maze must provide
+    `permissible_mask` for every heading index. Pruned cells are handled
+    as in `compute_policy`.
+
+    Returns three (dim, dim) arrays: value (time to reach the goal),
+    heading (index in `headings`, -1 if none) and movement.
+    """
+
+    dim = maze.dim
+    size = dim * dim
+    rows = [(movement, heading) for movement in range(1, max_movement + 1) for heading in range(len(headings))]
+
+    # cells from which every (movement, heading) row of straight moves is allowed;
+    # cells are flattened, so one move in a heading is a fixed index offset
+    steps = [move[0] * dim + move[1] for move in heading_moves]
+    offsets = np.array([movement * steps[heading] for movement, heading in rows])
+    runs = np.zeros((len(rows), size), dtype=bool)
+    for heading in range(len(headings)):
+        permissible = maze.permissible_mask(heading).ravel()
+        run = permissible
+        for movement in range(1, max_movement + 1):
+            runs[rows.index((movement, heading))] = run
+            # next move continues from the cell reached by this run
+            offset = movement * steps[heading]
+            shifted = np.zeros(size, dtype=bool)
+            if offset > 0:
+                shifted[:-offset] = permissible[offset:]
+            else:
+                shifted[-offset:] = permissible[:offset]
+            run = run & shifted
+
+    value = np.full(size, unreachable, dtype=np.int32)
+    heading = np.full(size, -1, dtype=np.int8)
+    movement = np.zeros(size, dtype=np.int8)
+    row_heading = np.array([h for _, h in rows], dtype=np.int8)
+    row_movement = np.array([m for m, _ in rows], dtype=np.int8)
+    row_index = np.arange(len(rows))[:, None]
+
+    pruned = getattr(maze, 'pruned_grid', None) if prune else None
+    if pruned is not None:
+        pruned = pruned.ravel()
+
+    frontier = np.unique([goal[0] * dim + goal[1] for goal in goals])
+    value[frontier] = 0
+    time = 0
+    while frontier.size:
+        time += 1
+        # candidates which reach the frontier in one step, one row per move
+        cells = frontier[None, :] - offsets[:, None]
+        inside = (cells >= 0) & (cells < size)
+        cells = np.where(inside, cells, 0)
+        found = inside & runs[row_index, cells] & (value[cells] == unreachable)
+        row, column = np.nonzero(found)
+        # rows are in order of preference, so the first occurrence wins
+        frontier, first = np.unique(cells[row, column], return_index=True)
+        value[frontier] = time
+        heading[frontier] = row_heading[row[first]]
+        movement[frontier] = row_movement[row[first]]
+        if pruned is not None:
+            frontier = frontier[pruned[frontier] == 0]
+
+    return value.reshape(dim, dim), heading.reshape(dim, dim), movement.reshape(dim, dim)
+
+
+def wavefront_policy(value, heading, movement):
+    """
+    Converts arrays computed by `compute_wavefront` to a Policy.
+    """
+
+    policy = Policy(len(value))
+    policy.time_grid[:] = value
+    policy.heading_grid[:] = heading
+    policy.movement_grid[:] = movement
+
+    return policy
+
+
+def policy_arrays(policy):
+    """
+    Returns (dim, dim) arrays of value, heading and movement of the policy,
+    as computed by `compute_wavefront`.
+    """
+
+    return policy.time_grid.copy(), policy.heading_grid.copy(), policy.movement_grid.copy()
+
+
+def is_preferred(policy, cell, heading, movement):
+    """
+    Checks if a move is preferred over the equally fast policy move of
+    the cell.
+    """
+
+    return (movement, heading) < (policy.movement[cell], policy.heading[cell])
+
+
+class Policy(object):
+    """
+    Moves to reach the goals from every cell, as parallel typed arrays over
+    cells flattened as x * dim + y: heading index (-1 if none), movement
+    and time to reach the goals (0 for goals, `unreachable` if none).
+    Planners read and write single entries; (dim, dim) NumPy views of the
+    same memory serve bulk access.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.heading = array('b', [-1]) * (dim * dim)
+        self.movement = array('b', [0]) * (dim * dim)
+        self.time = array('i', [unreachable]) * (dim * dim)
+        self.heading_grid = np.frombuffer(self.heading, dtype=np.int8).reshape(dim, dim)
+        self.movement_grid = np.frombuffer(self.movement, dtype=np.int8).reshape(dim, dim)
+        self.time_grid = np.frombuffer(self.time, dtype=np.int32).reshape(dim, dim)
+
+    def copy(self):
+        """
+        Returns independent copy of the policy.
+        """
+
+        policy = Policy(self.dim)
+        policy.heading[:] = self.heading
+        policy.movement[:] = self.movement
+        policy.time[:] = self.time
+        return policy
+
+    def entry(self, cell):
+        """
+        Returns the move of the cell as [heading, movement, time] with the
+        heading as a complete word, or None if there is no move.
+        """
+
+        c = cell[0] * self.dim + cell[1]
+        if self.heading[c] < 0:
+            return None
+        return [headings[self.heading[c]], self.movement[c], self.time[c]]
+
+
+class IncrementalPolicy(object):
+    """
+    Optimal policy to reach the goals, kept up to date as walls are spotted.
+
+    Unknown walls are treated as open, so a spotted wall can only block moves
+    and make values grow. On every update only cells whose policy move is
+    blocked by a new wall, and cells whose policy leads through them, are
+    re-evaluated. The result always equals `compute_policy` on the same maze,
+    except for pruned cells, which keep moves found before they were pruned.
+    The maze must provide the `wall` grid of robot's Maze.
+    """
+
+    def __init__(self, maze, goals, policy=None):
+        """
+        Starts from the given policy, computed for the same maze and goals
+        earlier, or computes it.
+        """
+
+        self.maze = maze
+        self.policy = policy if policy is not None else compute_policy(maze, goals)
+        for goal in goals:
+            self.policy.time[goal[0] * maze.dim + goal[1]] = 0
+
+        # offsets of a move in every heading in wall grids and over cells
+        self.offsets = [move[0] * maze.walls_dim + move[1] for move in heading_moves]
+        self.steps = [move[0] * maze.dim + move[1] for move in heading_moves]
+
+    def update(self, walls):
+        """
+        Repairs the policy after the maze has learned new walls. Walls are
+        given as (cell, heading, is_wall) tuples; confirmed openings do not
+        change the policy and are skipped.
+
+        Returns the set of re-evaluated cells, flattened as x * dim + y.
+        """
+
+        affected = self.find_affected(walls)
+        if not affected:
+            return affected
+
+        policy, dim, walls_dim, wall = self.policy, self.maze.dim, self.maze.walls_dim, self.maze.wall
+        value, heading, movement = policy.time, policy.heading, policy.movement
+        pruned = self.maze.pruned or bytearray(dim * dim)
+        for cell in affected:
+            value[cell] = unreachable
+            heading[cell] = -1
+            movement[cell] = 0
+
+        # seed affected cells from their unaffected neighbours
+        rest = []
+        for cell in affected:
+            x, y = divmod(cell, dim)
+            index = (2 * x + 1) * walls_dim + 2 * y + 1
+            for direction in range(len(headings)):
+                i = 1
+                offset, step = self.offsets[direction], self.steps[direction]
+                edge, cell2 = index + offset, cell
+                while i <= max_movement and not wall[edge]:
+                    edge += 2 * offset
+                    cell2 += step
+                    time2 = value[cell2] + 1
+                    if cell2 in affected or pruned[cell2] or time2 > min(value[cell], unreachable - 1):
+                        pass
+                    elif time2 < value[cell] or is_preferred(policy, cell, direction, i):
+                        value[cell] = time2
+                        heading[cell] = direction
+                        movement[cell] = i
+                    i += 1
+            if heading[cell] >= 0 and not pruned[cell]:
+                heapq.heappush(rest, (value[cell], cell))
+
+        # propagate new values through affected cells
+        while len(rest) > 0:
+            time, cell = heapq.heappop(rest)
+            if time != value[cell]:
+                continue
+            time2 = time + 1
+            x, y = divmod(cell, dim)
+            index = (2 * x + 1) * walls_dim + 2 * y + 1
+            for direction in range(len(headings)):
+                i = 1
+                offset, step = self.offsets[direction], self.steps[direction]
+                edge, cell2 = index + offset, cell
+                reverse = heading_reverses[direction]
+                while i <= max_movement and not wall[edge]:
+                    edge += 2 * offset
+                    cell2 += step
+                    if time2 < value[cell2]:
+                        if not pruned[cell2]:
+                            heapq.heappush(rest, (time2, cell2))
+                        value[cell2] = time2
+                        heading[cell2] = reverse
+                        movement[cell2] = i
+                    elif time2 == value[cell2] and is_preferred(policy, cell2, reverse, i):
+                        heading[cell2] = reverse
+                        movement[cell2] = i
+                    i += 1
+
+        return affected
+
+    def find_affected(self, walls):
+        """
+        Finds cells which policy moves cross any of the new walls, along with
+        all cells which policy leads through them.
+        """
+
+        dim, heading, movement = self.maze.dim, self.policy.heading, self.policy.movement
+
+        rest = []
+        for cell, direction, is_wall in walls:
+            if not is_wall:
+                continue
+            move = heading_moves[direction]
+            neighbour = (cell[0] + move[0], cell[1] + move[1])
+            # moves crossing the wall start up to `max_movement` cells behind it
+            for x, y, direction2 in ((cell[0], cell[1], direction),
+                                     (neighbour[0], neighbour[1], heading_reverses[direction])):
+                move2 = heading_moves[direction2]
+                for i in range(max_movement):
+                    if not (0 <= x < dim and 0 <= y < dim):
+                        break
+                    cell2 = x * dim + y
+                    if heading[cell2] == direction2 and movement[cell2] > i:
+                        rest.append(cell2)
+                    x -= move2[0]
+                    y -= move2[1]
+
+        affected = set()
+        while len(rest) > 0:
+            cell = rest.pop()
+            if cell in affected:
+                continue
+            affected.add(cell)
+            # cells which policy leads to the affected cell
+            for direction in range(len(headings)):
+                move = heading_moves[direction]
+                x, y = divmod(cell, dim)
+                for i in range(1, max_movement + 1):
+                    x -= move[0]
+                    y -= move[1]
+                    if not (0 <= x < dim and 0 <= y < dim):
+                        break
+                    cell2 = x * dim + y
+                    if heading[cell2] == direction and movement[cell2] == i:
+                        rest.append(cell2)
+
+        return affected
+
+
+class VerifiedPolicy(object):
+    """
+    Optimal policy to reach the goals over edges known to be open, kept up
+    to date as openings are spotted.
+
+    Unknown walls are treated as closed, so its times are upper bounds of
+    the times of the optimistic policy (see `IncrementalPolicy`), which are
+    lower bounds; when both are equal at a cell, no unknown edge can make
+    its route faster. A spotted opening can only add moves and make values
+    drop, so on every update values are lowered from cells around the new
+    openings. Moves are chosen with the same preferences as in
+    `compute_policy`; pruned cells get moves but values don't propagate
+    from them. The maze must provide the `known` and `wall` grids of
+    robot's Maze.
+    """
+
+    def __init__(self, maze, goals):
+        """
+        Computes the policy for edges known so far.
+        """
+
+        self.maze = maze
+        self.policy = Policy(maze.dim)
+
+        # offsets of a move in every heading in wall grids and over cells
+        self.offsets = [move[0] * maze.walls_dim + move[1] for move in heading_moves]
+        self.steps = [move[0] * maze.dim + move[1] for move in heading_moves]
+
+        rest = []
+        for goal in goals:
+            cell = goal[0] * maze.dim + goal[1]
+            self.policy.time[cell] = 0
+            rest.append((0, cell))
+        self.propagate(rest)
+
+    def update(self, walls):
+        """
+        Lowers values after the maze has learned new edges, given as
+        (cell, heading, is_wall) tuples; walls do not change the policy
+        and are skipped.
+        """
+
+        dim, value = self.maze.dim, self.policy.time
+
+        # moves through an opening start and end up to `max_movement` - 1
+        # cells behind it on either side
+        rest = []
+        for cell, direction, is_wall in walls:
+            if is_wall:
+                continue
+            move = heading_moves[direction]
+            neighbour = (cell[0] + move[0], cell[1] + move[1])
+            for x, y, direction2 in ((cell[0], cell[1], direction),
+                                     (neighbour[0], neighbour[1], heading_reverses[direction])):
+                move2 = heading_moves[direction2]
+                for i in range(max_movement):
+                    if not (0 <= x < dim and 0 <= y < dim):
+                        break
+                    cell2 = x * dim + y
+                    if value[cell2] < unreachable:
+                        rest.append((value[cell2], cell2))
+                    x -= move2[0]
+                    y -= move2[1]
+
+        heapq.heapify(rest)
+        self.propagate(rest)
+
+    def propagate(self, rest):
+        """
+        Lowers values of cells which reach cells of the heap of (time,
+        cell) in fewer time steps, in order of time. Every cell taken from
+        the heap has its final value, so its move is chosen again among
+        moves to cells already final, to break ties as `compute_policy`.
+        """
+
+        policy, dim, walls_dim = self.policy, self.maze.dim, self.maze.walls_dim
+        known, wall = self.maze.known, self.maze.wall
+        value, heading, movement = policy.time, policy.heading, policy.movement
+        pruned = self.maze.pruned or bytearray(dim * dim)
+
+        while len(rest) > 0:
+            time, cell = heapq.heappop(rest)
+            if time != value[cell]:
+                continue
+            x, y = divmod(cell, dim)
+            index = (2 * x + 1) * walls_dim + 2 * y + 1
+
+            if time > 0:
+                best = None
+                for direction in range(len(headings)):
+                    i = 1
+                    offset, step = self.offsets[direction], self.steps[direction]
+                    edge, cell2 = index + offset, cell
+                    while i <= max_movement and known[edge] and not wall[edge]:
+                        edge += 2 * offset
+                        cell2 += step
+                        if value[cell2] + 1 == time and (best is None or (i, direction) < best):
+                            best = (i, direction)
+                        i += 1
+                if best is not None:
+                    movement[cell], heading[cell] = best
+            if pruned[cell]:
+                continue
+
+            time2 = time + 1
+            for direction in range(len(headings)):
+                i = 1
+                offset, step = self.offsets[direction], self.steps[direction]
+                edge, cell2 = index + offset, cell
+                reverse = heading_reverses[direction]
+                while i <= max_movement and known[edge] and not wall[edge]:
+                    edge += 2 * offset
+                    cell2 += step
+                    if time2 < value[cell2]:
+                        heapq.heappush(rest, (time2, cell2))
+                        value[cell2] = time2
+                        heading[cell2] = reverse
+                        movement[cell2] = i
+                    elif time2 == value[cell2] and is_preferred(policy, cell2, reverse, i):
+                        heading[cell2] = reverse
+                        movement[cell2] = i
+                    i += 1
+
+
+class PolicyCache(object):
+    """
+    Bounded cache of policies keyed by goals and maze version, least
+    recently used policies are evicted first. Cached policies are shared
+    and must not be modified.
+    """
+
+    def __init__(self, size=16):
+        self.size = size
+        self.policies = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, maze, goals, prune=True):
+        """
+        Returns optimal policy to reach the goals, computing it only if the
+        goals or walls of the maze have changed since it was cached. Walls
+        change often while the robot explores, so misses use the wavefront
+        engine.
+        """
+
+        key = (tuple(tuple(goal) for goal in goals), maze.version, prune)
+        policy = self.policies.pop(key, None)
+        if policy is None:
+            self.misses += 1
+            policy = compute_policy(maze, goals, vectorized=True, prune=prune)
+        else:
+            self.hits += 1
+
+        self.policies[key] = policy
+        if len(self.policies) > self.size:
+            self.policies.popitem(last=False)
+
+        return policy
+
+
 def compute_path(policy, init):
     """
     Computes optimal path to reach the goal starting at init point.
+
+    Returns (n, 2) array of cells.
     """
 
     path = []
 
+    dim, heading, movement = policy.dim, policy.heading, policy.movement
     x, y = init
-    while policy[x][y]:
-        path.append([x, y])
-        heading, movement, _ = policy[x][y]
-        move = heading_move[heading]
-        x += movement * move[0]
-        y += movement * move[1]
-    path.append([x, y])
+    while heading[x * dim + y] >= 0:
+        path.append((x, y))
+        cell = x * dim + y
+        move = heading_moves[heading[cell]]
+        x += movement[cell] * move[0]
+        y += movement[cell] * move[1]
+    path.append((x, y))
 
-    return path
+    return np.array(path, dtype=int).reshape(-1, 2)
+
+
+def route_options():
+    """
+    Returns table of moves of a robot with the heading (index in
+    `headings`) towards a direction: one list of (rotation, heading after
+    the move, sign of movement) per direction. Every direction is reached
+    in one move from any heading, sideways ones with either rotation.
+    """
+
+    table = []
+    for heading in range(len(headings)):
+        table.append([[] for _ in headings])
+        for rotation in rotations:
+            turned = (heading + rotation / 90) % len(headings)
+            table[heading][turned].append((rotation, turned, 1))
+            table[heading][(turned + 2) % len(headings)].append((rotation, turned, -1))
+        for moves in table[heading]:
+            # moves without a rotation first
+            moves.sort(key=lambda move: abs(move[0]))
+
+    return table
+
+
+# moves of the robot towards a direction, by heading and direction
+direction_moves = route_options()
+
+
+def compute_route(maze, location, heading, goals, known_only=False, policy=None):
+    """
+    Plans the fastest moves from the location and heading to any of the
+    goals with A* over (cell, heading) states, following the tester rules:
+    a move is one of `rotations` followed by up to `max_movement` cells
+    forwards or backwards. Among equally fast routes the one with fewer
+    rotations is preferred. Heading is given as an index in `headings`.
+
+    Unknown walls are treated as open, unless `known_only` is set, then
+    only edges known to be open are crossed. Pruned cells are passed only
+    if the route starts in them. The maze must provide `wall` and `known`
+    grids of robot's Maze.
+
+    Heuristic is the time to reach the goals given by `policy`, computed
+    for the same maze with unknown walls open (e.g. IncrementalPolicy),
+    otherwise the moves needed along each axis to reach the bounding box of
+    the goals. Neither overestimates.
+
+    Returns list of (rotation, movement) moves, None if no goal is reachable.
+    """
+
+    dim, walls_dim = maze.dim, maze.walls_dim
+    wall, known = maze.wall, maze.known
+    pruned = maze.pruned or bytearray(dim * dim)
+    goal_cells = set(goal[0] * dim + goal[1] for goal in goals)
+
+    # cost of a route: time steps weighted over rotations, as a single number
+    weight = 4 * dim * dim + 1
+    offsets = [move[0] * walls_dim + move[1] for move in heading_moves]
+    steps = [move[0] * dim + move[1] for move in heading_moves]
+
+    if policy is None:
+        low_x, high_x = min(goal[0] for goal in goals), max(goal[0] for goal in goals)
+        low_y, high_y = min(goal[1] for goal in goals), max(goal[1] for goal in goals)
+        axis = [[max(low - i, i - high, 0) for i in range(dim)] for low, high in ((low_x, high_x), (low_y, high_y))]
+        estimate = [(-(-dx // max_movement) - (-dy // max_movement)) * weight for dx in axis[0] for dy in axis[1]]
+    else:
+        estimate = [min(time, dim * dim) * weight for time in policy.time]
+        for cell in goal_cells:
+            estimate[cell] = 0
+
+    # states are flattened as (x * dim + y) * 4 + heading index
+    start = (location[0] * dim + location[1]) * 4 + heading
+    cost = {start: 0}
+    parent = {start: None}
+    rest = [(estimate[start // 4], 0, start)]
+    while rest:
+        _, time, state = heapq.heappop(rest)
+        if time != cost[state]:
+            continue
+        cell, heading_index = divmod(state, 4)
+        if cell in goal_cells:
+            route = []
+            while parent[state] is not None:
+                state, move = parent[state]
+                route.append(move)
+            return route[::-1]
+
+        if pruned[cell] and state != start:
+            continue
+        x, y = divmod(cell, dim)
+        index = (2 * x + 1) * walls_dim + 2 * y + 1
+        for direction in range(len(headings)):
+            offset = offsets[direction]
+            options = direction_moves[heading_index][direction]
+            step = steps[direction]
+            edge = index + offset
+            cell2 = cell
+            for i in range(1, max_movement + 1):
+                if wall[edge] or known_only and not known[edge]:
+                    break
+                edge += 2 * offset
+                cell2 += step
+                remaining = estimate[cell2]
+                for rotation, heading2, sign in options:
+                    state2 = cell2 * 4 + heading2
+                    time2 = time + weight + (rotation != 0)
+                    if time2 < cost.get(state2, unreachable):
+                        cost[state2] = time2
+                        parent[state2] = (state, (rotation, sign * i))
+                        heapq.heappush(rest, (time2 + remaining, time2, state2))
+
+    return None
+
+
+def route_time(route):
+    """
+    Returns number of time steps and rotations of the route.
+    """
+
+    return len(route), sum(1 for rotation, _ in route if rotation)
 
 
 def last_unvisited(maze, path):
     """
-    Finds the last unvisited cell from the path.
+    Finds the last unvisited cell from the path, probing the maze's
+    frontier index once per cell. Pruned cells are skipped.
 
     Returns None if all cells are visited or path is empty.
     """
 
+    unknown, dim = maze.unknown, maze.dim
+    pruned = maze.pruned or bytearray(dim * dim)
     for cell in reversed(path):
-        if not maze.is_visited(cell):
+        if unknown[cell[0] * dim + cell[1]] and not pruned[cell[0] * dim + cell[1]]:
             return cell
 
     return None
 
 
+def nearest_unvisited(maze, location, path=None):
+    """
+    Finds the unvisited cell which takes the least time steps to reach from
+    the location, based on current maze data, among cells of the path if
+    given. Pruned cells are skipped.
+
+    Returns None if no such unvisited cell is reachable.
+    """
+
+    # pruned cells are never on a route, but the robot may stand in one
+    value, _, _ = compute_wavefront(maze, [location], prune=False)
+    if path is not None:
+        cells = np.array(maze.unvisited_on(path), dtype=int).reshape(-1, 2)
+        on_path = np.full_like(value, unreachable)
+        on_path[cells[:, 0], cells[:, 1]] = value[cells[:, 0], cells[:, 1]]
+        value = on_path
+    return maze.nearest_unvisited(value)
+
+
 def estimate_score(maze, init, goal_bounds, train_score_ratio):
     """
     Estimates score for given maze, inti and goal points.
@@ -106,7 +739,7 @@ def estimate_score(maze, init, goal_bounds, train_score_ratio):
     goals = [[x, y] for x in goal_bounds for y in goal_bounds]
     policy = compute_policy(maze, goals)
 
-    _, _, optimal_time = policy[init[0]][init[1]]
+    optimal_time = policy.time[init[0] * maze.dim + init[1]]
 
     best_score = optimal_time + float(optimal_time) * train_score_ratio
     worst_score = optimal_time + float(maze.dim ** 2) * train_score_ratio
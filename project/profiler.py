@@ -0,0 +1,213 @@
+import argparse
+import importlib
+import json
+import sys
+from timeit import default_timer as timer
+
+# names of Robot modes, indexed by mode
+mode_names = ['exploring', 'validating', 'testing']
+
+# instrumented functions: module, class (None for module functions) and name
+hooks = [
+    ('robot', 'Robot', 'next_move'),
+    ('robot', 'Robot', 'update_maze'),
+    ('policy', None, 'compute_policy'),
+    ('policy', 'IncrementalPolicy', 'update'),
+    ('policy', 'VerifiedPolicy', '__init__'),
+    ('policy', 'VerifiedPolicy', 'update'),
+    ('policy', 'PolicyCache', 'get'),
+    ('policy', None, 'compute_path'),
+    ('policy', None, 'compute_route'),
+    ('policy', None, 'last_unvisited'),
+    ('policy', None, 'nearest_unvisited'),
+    ('maze', 'Maze', 'dist_to_wall'),
+]
+
+# functions which recompute or repair a policy
+replans = ['compute_policy', 'IncrementalPolicy.update']
+
+
+class Profiler(object):
+    """
+    Collects call counts and time of the robot's and environment's hot
+    functions, broken down by robot mode, and a histogram of policy
+    recomputations per step.
+
+    Functions are wrapped only between `install` and `uninstall`, so the
+    code runs unchanged when profiling is off. Calls are attributed to the
+    mode of the robot at the start of the current step; nested calls are
+    included in the time of the outer function.
+    """
+
+    def __init__(self):
+        self.mode = 0
+        self.replans = 0
+        self.modes = {}
+        for name in mode_names:
+            self.modes[name] = {'steps': 0, 'replans': 0, 'replans_per_step': {}, 'functions': {}}
+        self.patches = []
+
+    def install(self):
+        """
+        Wraps instrumented functions, in every loaded module which
+        imported them by name as well.
+        """
+
+        for module_name, class_name, name in hooks:
+            module = importlib.import_module(module_name)
+            if class_name:
+                owner = getattr(module, class_name)
+                self.patch(owner, name, self.wrap(class_name + '.' + name, owner.__dict__[name]))
+            else:
+                function = getattr(module, name)
+                wrapper = self.wrap(name, function)
+                for other in sys.modules.values():
+                    if getattr(other, name, None) is function:
+                        self.patch(other, name, wrapper)
+
+    def uninstall(self):
+        """
+        Restores original functions.
+        """
+
+        for owner, name, original in reversed(self.patches):
+            setattr(owner, name, original)
+        self.patches = []
+
+    def patch(self, owner, name, wrapper):
+        self.patches.append((owner, name, owner.__dict__[name]))
+        setattr(owner, name, wrapper)
+
+    def wrap(self, name, function):
+        """
+        Returns the function which counts calls and time of the original.
+        """
+
+        if name == 'Robot.next_move':
+            return self.wrap_step(function)
+
+        replan = name in replans
+
+        def wrapper(*args, **kwargs):
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, timer() - start)
+                if replan:
+                    self.replans += 1
+
+        return wrapper
+
+    def wrap_step(self, next_move):
+        """
+        Returns Robot.next_move which also tracks robot's mode and counts
+        policy recomputations within the step.
+        """
+
+        def wrapper(robot, sensors):
+            self.mode = robot.mode
+            self.replans = 0
+            start = timer()
+            try:
+                return next_move(robot, sensors)
+            finally:
+                self.add('Robot.next_move', timer() - start)
+                stats = self.modes[mode_names[self.mode]]
+                stats['steps'] += 1
+                stats['replans'] += self.replans
+                histogram = stats['replans_per_step']
+                histogram[self.replans] = histogram.get(self.replans, 0) + 1
+                # sensing before the next step belongs to the new mode
+                self.mode = robot.mode
+
+        return wrapper
+
+    def add(self, name, elapsed):
+        functions = self.modes[mode_names[self.mode]]['functions']
+        if name not in functions:
+            functions[name] = {'calls': 0, 'time': 0.}
+        functions[name]['calls'] += 1
+        functions[name]['time'] += elapsed
+
+    def to_dict(self):
+        """
+        Returns collected stats as a JSON serializable dict.
+        """
+
+        stats = {}
+        for name, mode in self.modes.iteritems():
+            stats[name] = dict(mode)
+            stats[name]['replans_per_step'] = dict((str(count), steps)
+                                                   for count, steps in mode['replans_per_step'].iteritems())
+            stats[name]['functions'] = dict((function, dict(entry))
+                                            for function, entry in mode['functions'].iteritems())
+        return stats
+
+    def merge(self, stats):
+        """
+        Adds stats of other profiler, given as returned by `to_dict`.
+        """
+
+        for name, mode in stats.iteritems():
+            own = self.modes[name]
+            own['steps'] += mode['steps']
+            own['replans'] += mode['replans']
+            for count, steps in mode['replans_per_step'].iteritems():
+                own['replans_per_step'][int(count)] = own['replans_per_step'].get(int(count), 0) + steps
+            for function, entry in mode['functions'].iteritems():
+                if function not in own['functions']:
+                    own['functions'][function] = {'calls': 0, 'time': 0.}
+                own['functions'][function]['calls'] += entry['calls']
+                own['functions'][function]['time'] += entry['time']
+
+    def write(self, filename):
+        """
+        Writes stats to a JSON file.
+        """
+
+        with open(filename, 'wb') as f_out:
+            json.dump(self.to_dict(), f_out, indent=2, sort_keys=True)
+
+    def report(self):
+        """
+        Prints stats as a table per mode.
+        """
+
+        for name in mode_names:
+            mode = self.modes[name]
+            if not mode['steps']:
+                continue
+            print '{}: {} steps, {:.2f} replans per step'.format(name, mode['steps'],
+                                                                 float(mode['replans']) / mode['steps'])
+            functions = sorted(mode['functions'].iteritems(), key=lambda item: -item[1]['time'])
+            for function, entry in functions:
+                print '  {:<26} {:>8} calls {:>10.2f} ms {:>10.1f} us/call'.format(
+                    function, entry['calls'], entry['time'] * 1000, entry['time'] / entry['calls'] * 1e6)
+
+
+if __name__ == '__main__':
+    '''
+    This script profiles a trial of the robot on the given maze.
+    '''
+
+    from maze import Maze
+    from tester import run_trial
+
+    parser = argparse.ArgumentParser(description='Profile a trial of the robot.')
+    parser.add_argument('maze', help='maze file')
+    parser.add_argument('-o', '--output', default=None, help='JSON file to write stats to')
+    args = parser.parse_args()
+
+    maze = Maze(args.maze)
+    profiler = Profiler()
+    profiler.install()
+    try:
+        result = run_trial(maze)
+    finally:
+        profiler.uninstall()
+
+    print 'Score: {}, steps: {}'.format(result.score, result.steps)
+    profiler.report()
+    if args.output:
+        profiler.write(args.output)
@@ -0,0 +1,283 @@
+import argparse
+import os
+import numpy as np
+from maze import Maze
+from policy import compute_path, compute_policy, heading_rank, headings, rotations
+from robot import Maze as RobotMaze
+
+# recorded move: run, robot position and heading after the move, action and
+# number of walls learned by the robot on the move
+step_dtype = np.dtype([('run', np.uint8), ('x', np.int16), ('y', np.int16), ('heading', np.uint8),
+                       ('rotation', np.int8), ('movement', np.int8), ('walls', np.uint16)])
+
+# learned edge: cell, heading of the edge and presence of a wall
+wall_dtype = np.dtype([('x', np.int16), ('y', np.int16), ('heading', np.uint8), ('is_wall', np.bool_)])
+
+# rotation and movement code of ('Reset', 'Reset')
+reset_code = -128
+
+
+class Trace(object):
+    """
+    Compact record of a trial: every move of the robot along with the walls
+    it learned on the move, and the maze itself, so the trial can be replayed
+    without the robot. Moves are appended to lists while recording and packed
+    to structured arrays by `finish`.
+    """
+
+    def __init__(self, maze, goals):
+        self.maze = maze
+        self.goals = [list(goal) for goal in goals]
+
+        # pending records and packed arrays
+        self.records = []
+        self.learned = []
+        self.steps = np.zeros(0, dtype=step_dtype)
+        self.walls = np.zeros(0, dtype=wall_dtype)
+
+    def append(self, run, location, heading, rotation, movement, walls):
+        """
+        Records a move; `walls` are (cell, heading index, is_wall) tuples
+        learned by the robot on the move.
+        """
+
+        if rotation == 'Reset':
+            rotation = movement = reset_code
+        elif rotation not in rotations:
+            rotation = 0
+        self.records.append((run, location[0], location[1], heading_rank[heading], rotation, movement, len(walls)))
+        for cell, side, is_wall in walls:
+            self.learned.append((cell[0], cell[1], side, is_wall))
+
+    def finish(self):
+        """
+        Packs pending records to arrays.
+        """
+
+        if self.records:
+            self.steps = np.concatenate([self.steps, np.array(self.records, dtype=step_dtype)])
+            self.walls = np.concatenate([self.walls, np.array(self.learned, dtype=wall_dtype)])
+            self.records, self.learned = [], []
+
+    def __len__(self):
+        return len(self.steps) + len(self.records)
+
+    def __iter__(self):
+        """
+        Iterates over moves as (run, location, heading, rotation, movement).
+        """
+
+        self.finish()
+        for run, x, y, heading, rotation, movement, _ in self.steps.tolist():
+            if rotation == reset_code:
+                rotation = movement = 'Reset'
+            yield run, (x, y), headings[heading], rotation, movement
+
+    def save(self, filename):
+        """
+        Writes the trace to a compressed NumPy archive.
+        """
+
+        self.finish()
+        np.savez_compressed(filename, steps=self.steps, walls=self.walls, goals=np.array(self.goals),
+                            maze=self.maze.walls.astype(np.uint8), name=np.array(self.maze.filename))
+
+
+def load_trace(filename):
+    """
+    Reads a trace written by `Trace.save`.
+    """
+
+    data = np.load(filename)
+    trace = Trace(Maze(str(data['name']), data['maze'].astype(int)), data['goals'].tolist())
+    trace.steps = data['steps']
+    trace.walls = data['walls']
+
+    return trace
+
+
+class ReplayRobot(object):
+    """
+    Robot's data restored from a trace at a given move, in the form used by
+    Simulator. Policy is recomputed only when the known walls change; path
+    from the robot's position follows the policy to reach the goal.
+    """
+
+    def __init__(self, trace):
+        trace.finish()
+        self.trace = trace
+        self.init = [0, 0]
+        self.goals = trace.goals
+
+        # index of the first learned wall of every move
+        self.offsets = np.concatenate([[0], np.cumsum(trace.steps['walls'], dtype=int)])
+
+        self.rewind()
+
+    def rewind(self):
+        """
+        Restores the state before the first move.
+        """
+
+        self.maze = RobotMaze(self.trace.maze.dim)
+        self.position = 0
+        self.location = [self.init[0], self.init[1]]
+        self.heading = heading_rank['up']
+        self._policy = self._optimal = self._path = None
+
+    def seek(self, position):
+        """
+        Restores the state after `position` moves, at most the trace length.
+        """
+
+        position = max(0, min(position, len(self.trace.steps)))
+        if position < self.position:
+            self.rewind()
+        if position == self.position:
+            return
+
+        version = self.maze.version
+        for x, y, heading, is_wall in self.trace.walls[self.offsets[self.position]:self.offsets[position]].tolist():
+            self.maze.set_wall((x, y), heading, is_wall)
+
+        step = self.trace.steps[position - 1]
+        self.position = position
+        self.location = [int(step['x']), int(step['y'])]
+        self.heading = int(step['heading'])
+        if self.maze.version != version:
+            self._policy = self._optimal = None
+        self._path = None
+
+    @property
+    def policy(self):
+        if self._policy is None:
+            self._policy = compute_policy(self.maze, self.goals, vectorized=True)
+        return self._policy
+
+    @property
+    def optimal(self):
+        if self._optimal is None:
+            self._optimal = compute_path(self.policy, self.init)
+        return self._optimal
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = compute_path(self.policy, self.location)
+        return self._path
+
+
+def positions(trace, start=0, stop=None, stride=1):
+    """
+    Returns replayed positions: from `start` to `stop` moves (the trace
+    length by default) with the given stride, the last one always included.
+    """
+
+    length = len(trace.steps)
+    stop = length if stop is None else max(0, min(stop, length))
+    start = max(0, min(start, stop))
+    result = range(start, stop, max(1, stride))
+    result.append(stop)
+
+    return result
+
+
+def replay(trace, delay=50, start=0, stop=None, stride=1, show_maze=False, show_policy=True):
+    """
+    Shows the trace in Simulator with `delay` ms between frames, which
+    doesn't depend on the speed of the recorded trial. Replay can start
+    and stop at any move and skip moves with `stride`.
+    """
+
+    from simulator import Simulator
+
+    robot = ReplayRobot(trace)
+    moves = positions(trace, start, stop, stride)
+    robot.seek(moves[0])
+    simulator = Simulator(trace.maze, robot, delay=delay, show_maze=show_maze, show_policy=show_policy)
+    for position in moves[1:]:
+        if not simulator.game:
+            break
+        robot.seek(position)
+        simulator.render()
+
+
+def export(trace, output, start=0, stop=None, stride=1, show_maze=False, show_policy=True, duration=50):
+    """
+    Renders the trace off-screen, without a window. If output ends with .gif
+    frames are saved as an animated GIF with `duration` ms per frame (needs
+    PIL), otherwise as PNG files in the output directory. Returns number of
+    frames.
+    """
+
+    from simulator import Simulator
+
+    gif = output.lower().endswith('.gif')
+    if gif:
+        from PIL import Image
+        frames = []
+    elif not os.path.isdir(output):
+        os.makedirs(output)
+
+    robot = ReplayRobot(trace)
+    moves = positions(trace, start, stop, stride)
+    robot.seek(moves[0])
+    simulator = Simulator(trace.maze, robot, show_maze=show_maze, show_policy=show_policy, headless=True)
+    for i, position in enumerate(moves):
+        robot.seek(position)
+        simulator.render()
+        if gif:
+            size = simulator.screen.get_size()
+            frames.append(Image.frombytes('RGB', size, simulator.game.image.tostring(simulator.screen, 'RGB')))
+        else:
+            simulator.game.image.save(simulator.screen, os.path.join(output, 'frame_{:05d}.png'.format(i)))
+
+    if gif:
+        frames[0].save(output, save_all=True, append_images=frames[1:], duration=duration, loop=0)
+
+    return len(moves)
+
+
+if __name__ == '__main__':
+    '''
+    This script records trials to trace files, replays and exports them.
+    '''
+
+    from tester import run_trial
+
+    parser = argparse.ArgumentParser(description='Record, replay and export trial traces.')
+    commands = parser.add_subparsers(dest='command')
+
+    parser_record = commands.add_parser('record', help='run a trial and save its trace')
+    parser_record.add_argument('maze', help='maze file')
+    parser_record.add_argument('trace', help='trace file (.npz)')
+
+    for name, description in [('replay', 'show a trace in the simulator'),
+                              ('export', 'render a trace to PNG frames or GIF')]:
+        parser_command = commands.add_parser(name, help=description)
+        parser_command.add_argument('trace', help='trace file (.npz)')
+        if name == 'replay':
+            parser_command.add_argument('-d', '--delay', type=int, default=50, help='frame delay in milliseconds')
+        else:
+            parser_command.add_argument('output', help='GIF file or directory for PNG frames')
+            parser_command.add_argument('-d', '--duration', type=int, default=50,
+                                        help='GIF frame duration in milliseconds')
+        parser_command.add_argument('--start', type=int, default=0, help='first move')
+        parser_command.add_argument('--stop', type=int, default=None, help='last move')
+        parser_command.add_argument('--stride', type=int, default=1, help='moves per frame')
+        parser_command.add_argument('--show-maze', action='store_true', help='display the maze')
+        parser_command.add_argument('--hide-policy', action='store_true', help='do not display the policy')
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        result = run_trial(Maze(args.maze), trace=True)
+        result.trace.save(args.trace)
+        print 'Recorded {} moves, score: {}'.format(len(result.trace), result.score)
+    elif args.command == 'replay':
+        replay(load_trace(args.trace), args.delay, args.start, args.stop, args.stride,
+               args.show_maze, not args.hide_policy)
+    else:
+        count = export(load_trace(args.trace), args.output, args.start, args.stop, args.stride,
+                       args.show_maze, not args.hide_policy, args.duration)
+        print 'Exported {} frames to {}'.format(count, args.output)
@@ -1,3 +1,4 @@
+import numpy as np
 from policy import *
 
 
@@ -15,14 +16,34 @@ class Robot(object):
         self.goals = [[x, y] for x in goal_bounds for y in goal_bounds]
 
         self.maze = Maze(maze_dim)
+        self.maze.enable_pruning(self.init, self.goals)
 
-        self.path = []
-        self.optimal = []
-        self.policy = None
+        self.planner = IncrementalPolicy(self.maze, self.goals)
+        self.policies = PolicyCache()
+
+        # policy to reach the goals and policy followed on the last move
+        self.policy = self.planner.policy
+        self.current_policy = None
+
+        # policy over edges known to be open, kept from `validating` phase
+        self.verified = None
+
+        # unvisited cell of the optimal path visited in `validating` phase
+        self.target = None
+
+        # moves planned for `testing` phase
+        self.route = []
+
+        # walls learned on the last move, kept for trace recording
+        self.learned = []
+
+        # paths for visualization, computed on first access
+        self._optimal = None
+        self._path = None
 
         # start `exploring`
         self.mode = Robot.Exploring
-        self.heading = 'up'
+        self.heading = heading_rank['up']
         self.location = [self.init[0], self.init[1]]
 
     def next_move(self, sensors):
@@ -48,40 +69,115 @@ class Robot(object):
         """
 
         # update maze data, based on sensors
-        if self.update_maze(sensors):
-            # update policy and solution if maze was updated
-            self.policy = compute_policy(self.maze, self.goals)
-            self.optimal = compute_path(self.policy, self.init)
+        walls = self.learned = self.update_maze(sensors)
+        if walls:
+            # repair policy and update solution if maze was updated
+            self.planner.update(walls)
+            self.policy = self.planner.policy
+            self._optimal = None
 
         # goal is reached in `exploring` phase, switch to `connecting` phase
         if self.mode == Robot.Exploring and self.location in self.goals:
             self.mode = Robot.Validating
 
         current_policy = self.policy
+        targets = self.goals
         if self.mode == Robot.Validating:
-            # during `connecting` phase robot visits all unvisited cells
-            # from the solution path and verifies that this path is optimal
-            unvisited = last_unvisited(self.maze, self.optimal + self.goals)
-            if unvisited:
-                current_policy = compute_policy(self.maze, [unvisited])
+            # during `connecting` phase robot visits unvisited cells from the
+            # solution path, each time the nearest one, until no unknown edge
+            # can make a path faster than the verified one: times of the policy
+            # and of the verified policy from the init point are lower and
+            # upper bounds of the best time
+            if self.verified is None:
+                self.verified = VerifiedPolicy(self.maze, self.goals)
+            elif walls:
+                self.verified.update(walls)
+            init = self.init[0] * self.maze.dim + self.init[1]
+            unvisited = None
+            if self.verified.policy.time[init] > self.policy.time[init]:
+                unvisited = last_unvisited(self.maze, self.goals)
+                if unvisited is None:
+                    # the target is kept while it's unvisited and on the path
+                    if self.target not in self.maze.unvisited_on(self.optimal):
+                        self.target = nearest_unvisited(self.maze, self.location, self.optimal)
+                    unvisited = self.target
+            if unvisited is not None:
+                targets = [unvisited]
+                current_policy = self.policies.get(self.maze, targets)
             else:
                 # if there are no unvisited cells switch to `testing` phase
                 self.mode = Robot.Testing
-                self.heading = 'up'
+                self.heading = heading_rank['up']
                 self.location = [self.init[0], self.init[1]]
+                # route over verified openings is as fast as the policy,
+                # with the least rotations
+                self.route = compute_route(self.maze, self.location, self.heading, self.goals,
+                                           known_only=True, policy=self.policy) or []
+                self.current_policy = None
+                self._path = None
                 return 'Reset', 'Reset'
 
-        # find next rotation and movement, based on policy
-        rotation, movement = self.next_action(current_policy)
+        # policies skip pruned cells, so moves from a dead end the robot has
+        # just found are searched without pruning
+        if self.maze.pruned[self.location[0] * self.maze.dim + self.location[1]]:
+            current_policy = self.policies.get(self.maze, targets, prune=False)
+
+        # find next rotation and movement, based on planned route or policy
+        if self.mode == Robot.Testing and self.route:
+            rotation, movement = self.route.pop(0)
+            rotation = rotations.index(rotation)
+        else:
+            rotation, movement = self.next_action(current_policy)
 
         # update internal state (heading, location) of a robot
         self.update_state(sensors, rotation, movement)
 
-        # update current path for visualization
-        self.path = compute_path(current_policy, self.location)
+        # current path for visualization is computed on demand
+        self.current_policy = current_policy
+        self._path = None
 
         return rotations[rotation], movement
 
+    def restore(self, known, wall, version, policy=None):
+        """
+        Replaces maze data with previously learned walls, given as grids
+        of the robot's Maze, and the policy computed for them, if known.
+        Robot then starts with this knowledge, complete or partial.
+        """
+
+        self.maze.restore(known, wall, version)
+        self.planner = IncrementalPolicy(self.maze, self.goals, policy)
+        self.policies = PolicyCache()
+        self.policy = self.planner.policy
+        self.verified = None
+        self.target = None
+        self._optimal = None
+
+    @property
+    def optimal(self):
+        """
+        Optimal path from the init point, computed on first access
+        after the policy has changed.
+        """
+
+        if self._optimal is None:
+            self._optimal = compute_path(self.policy, self.init)
+        return self._optimal
+
+    @property
+    def path(self):
+        """
+        Path from the current location following the policy of the last
+        move, computed on first access after the move.
+        """
+
+        if self._path is None:
+            if self.current_policy:
+                self._path = compute_path(self.current_policy, self.location)
+            else:
+                self._path = np.zeros((0, 2), dtype=int)
+        return self._path
+
     def next_action(self, policy):
         """
         Chooses next rotation and movement, based on optimal policy, current
@@ -90,14 +186,15 @@ class Robot(object):
         and does negative movement.
         """
 
-        x, y = self.location
-        heading, movement, _ = policy[x][y]
+        cell = self.location[0] * self.maze.dim + self.location[1]
+        heading, movement = policy.heading[cell], policy.movement[cell]
 
-        if self.heading == heading_reverse[heading]:
+        if self.heading == heading_reverses[heading]:
             movement *= -1
             heading = self.heading
 
-        rotation = heading_rotation[self.heading].index(heading)
+        # index in `rotations`: turn left, none or right
+        rotation = (heading - self.heading + 1) % len(headings)
 
         return rotation, movement
 
@@ -108,46 +205,92 @@ class Robot(object):
         """
 
         # update heading
-        self.heading = heading_rotation[self.heading][rotation]
+        self.heading = heading_rotations[self.heading][rotation]
 
         # check for a wall
         movement = min(sensors[rotation], movement)
 
         # update position
-        move = heading_move[self.heading]
+        move = heading_moves[self.heading]
         self.location[0] += movement * move[0]
         self.location[1] += movement * move[1]
 
     def update_maze(self, sensors):
         """
         Updates information about spotted walls.
-        Returns true if maze data is updated.
+        Returns list of newly learned walls as (cell, heading, is_wall).
         """
 
-        updated = False
+        walls = []
         for s in range(len(sensors)):
-            heading = heading_rotation[self.heading][s]
-            x, y = self.location
-            move = heading_move[heading]
-            for i in range(sensors[s]):
-                updated |= self.maze.set_wall([x, y], heading, False)
-                x += move[0]
-                y += move[1]
-            updated |= self.maze.set_wall([x, y], heading, True)
+            walls.extend(self.maze.mark_ray(self.location, heading_rotations[self.heading][s], sensors[s]))
 
-        return updated
+        return walls
 
 
 class Maze(object):
     """
     Internal robot's representation of the maze.
     Holds information about borders and spotted walls.
+
+    Walls are stored in two byte grids over the wall coordinates (doubled cell
+    coordinates, border included): `known` marks edges which state is known
+    and `wall` marks edges with a wall. Border is known and walled from start.
+
+    Version is increased with every new wall. Unknown edges are permissible,
+    so policies depend only on the version, not on spotted openings.
+
+    Frontier index `unknown` holds the number of unknown edges of every cell
+    and is updated as edges are learned; cells with unknown edges are the
+    unvisited ones.
+
+    Once `enable_pruning` is called, cells which can't be on a route from
+    the init point to the goals are marked in `pruned` as walls are learned:
+    dead ends and regions sealed off from the init point by known walls.
+
+    Headings are given as indices in `headings`.
     """
+    Kept, DeadEnd, Sealed = range(3)
 
     def __init__(self, dim):
         self.dim = dim
-        self.walls = {}
-        self.walls_dim = 2 * (dim - 1)
+        self.walls_dim = 2 * dim + 1
+        self.known = bytearray(self.walls_dim ** 2)
+        self.wall = bytearray(self.walls_dim ** 2)
+        self.version = 0
+
+        # offset of the edge in every heading from the cell's wall index
+        self.offset = [move[0] * self.walls_dim + move[1] for move in heading_moves]
+
+        # array views sharing memory with byte grids, used by bulk queries
+        self.known_grid = np.frombuffer(self.known, dtype=np.uint8).reshape(self.walls_dim, self.walls_dim)
+        self.wall_grid = np.frombuffer(self.wall, dtype=np.uint8).reshape(self.walls_dim, self.walls_dim)
+
+        for grid in (self.known_grid, self.wall_grid):
+            grid[[0, -1], :] = 1
+            grid[:, [0, -1]] = 1
+
+        # frontier index over cells, flattened as x * dim + y, and offsets of
+        # the neighbour in every heading
+        self.unknown = bytearray(dim * dim)
+        self.unknown_grid = np.frombuffer(self.unknown, dtype=np.uint8).reshape(dim, dim)
+        self.unknown_grid[:] = 4
+        for border in (self.unknown_grid[0], self.unknown_grid[-1], self.unknown_grid[:, 0], self.unknown_grid[:, -1]):
+            border -= 1
+        self.step = [move[0] * dim + move[1] for move in heading_moves]
+
+        # pruning, disabled until the init point and goals are given
+        self.init = None
+        self.protected = None
+        self.pruned = None
+        self.pruned_grid = None
+
+    def index(self, cell):
+        """
+        Maps the cell coordinates to the index of its center in wall grids.
+        """
+
+        return (2 * cell[0] + 1) * self.walls_dim + 2 * cell[1] + 1
 
     def set_wall(self, cell, heading, is_wall):
         """
@@ -155,41 +298,269 @@ class Maze(object):
         information about a presence of a wall in specific heading.
         """
 
-        updated = False
-        move = heading_move[heading]
-        x_ = 2 * cell[0] + move[0]
-        y_ = 2 * cell[1] + move[1]
-        if not (x_, y_) in self.walls:
-            self.walls[x_, y_] = is_wall
-            updated = True
+        i = self.index(cell) + self.offset[heading]
+        if self.known[i]:
+            return False
+
+        self.known[i] = 1
+        c = cell[0] * self.dim + cell[1]
+        self.unknown[c] -= 1
+        self.unknown[c + self.step[heading]] -= 1
+        if is_wall:
+            self.wall[i] = 1
+            self.version += 1
+            if self.pruned is not None:
+                self.prune_wall(i, c, heading)
+        return True
 
-        return updated
+    def mark_ray(self, cell, heading, length):
+        """
+        Stores information about a sensor ray: `length` open edges from the
+        cell in the specific heading and the wall ending them. Edges are
+        written with a single slice assignment.
+        Returns list of newly learned edges as (cell, heading, is_wall).
+        """
 
-    def is_visited(self, cell):
+        step = 2 * self.offset[heading]
+        start = self.index(cell) + self.offset[heading]
+        end = start + length * step
+        ray = slice(start, end + step if end + step >= 0 else None, step)
+
+        known = self.known[ray]
+        if known.find('\x00') < 0:
+            return []
+
+        learned = []
+        move = heading_moves[heading]
+        x, y = cell
+        unknown, cell_step = self.unknown, self.step[heading]
+        for i in range(length + 1):
+            if not known[i]:
+                c = (x + i * move[0]) * self.dim + y + i * move[1]
+                unknown[c] -= 1
+                unknown[c + cell_step] -= 1
+                learned.append(((x + i * move[0], y + i * move[1]), heading, i == length))
+
+        self.known[ray] = '\x01' * (length + 1)
+        if not known[length]:
+            self.wall[end] = 1
+            self.version += 1
+            if self.pruned is not None:
+                self.prune_wall(end, (x + length * move[0]) * self.dim + y + length * move[1], heading)
+
+        return learned
+
+    def copy_walls(self):
         """
-        Maps the cell coordinates to wall coordinates and checks
-        if a presence of the walls for the specific cell is known.
+        Returns independent copy of the known and wall grids and of the
+        frontier index, for display. Pruning isn't copied.
+        """
+
+        maze = Maze.__new__(Maze)
+        maze.__dict__.update(self.__dict__)
+        maze.known = bytearray(self.known)
+        maze.wall = bytearray(self.wall)
+        maze.unknown = bytearray(self.unknown)
+        maze.known_grid = np.frombuffer(maze.known, dtype=np.uint8).reshape(self.known_grid.shape)
+        maze.wall_grid = np.frombuffer(maze.wall, dtype=np.uint8).reshape(self.wall_grid.shape)
+        maze.unknown_grid = np.frombuffer(maze.unknown, dtype=np.uint8).reshape(self.unknown_grid.shape)
+        maze.protected = maze.pruned = maze.pruned_grid = None
+        for name in ('exits', 'corners'):
+            maze.__dict__.pop(name, None)
+        return maze
+
+    def restore(self, known, wall, version):
+        """
+        Replaces learned walls with the given known and wall grids and
+        rebuilds the frontier index.
         """
 
-        for heading in heading_move:
-            move = heading_move[heading]
-            x_ = 2 * cell[0] + move[0]
-            y_ = 2 * cell[1] + move[1]
-            if self.in_bound(x_, y_) and not (x_, y_) in self.walls:
-                return False
+        self.known_grid[:] = known
+        self.wall_grid[:] = wall
+        self.version = version
+        self.unknown_grid[:] = 0
+        for heading in range(len(headings)):
+            self.unknown_grid += ~self.defined_mask(heading)
+        if self.pruned is not None:
+            self.rebuild_pruning()
 
+    def enable_pruning(self, init, goals):
+        """
+        Starts pruning cells which can't be on a route from the init point
+        to the goals, which are never pruned themselves: dead ends, cells
+        with a single exit applied recursively, and regions sealed off from
+        the init point by known walls.
+        """
+
+        self.init = init[0] * self.dim + init[1]
+        self.protected = set([self.init] + [goal[0] * self.dim + goal[1] for goal in goals])
+        self.rebuild_pruning()
+
+    def rebuild_pruning(self):
+        """
+        Classifies all cells from scratch, based on known walls.
+        """
+
+        dim, walls_dim, wall = self.dim, self.walls_dim, self.wall
+        self.pruned = bytearray(dim * dim)
+        self.pruned_grid = np.frombuffer(self.pruned, dtype=np.uint8).reshape(dim, dim)
+
+        # union-find over corners of the wall grids, joined by known walls
+        self.corners = range(walls_dim ** 2)
+        is_edge = np.add.outer(np.arange(walls_dim), np.arange(walls_dim)) % 2 == 1
+        for i, j in np.argwhere(is_edge & (self.wall_grid == 1)).tolist():
+            self.join_corners(*self.edge_corners(i * walls_dim + j, i % 2))
+
+        # cells not reached from the init point are sealed
+        reached = self.component(self.init)
+        for c in range(dim * dim):
+            if c not in reached and c not in self.protected:
+                self.pruned[c] = Maze.Sealed
+
+        # open edges of every cell, dead ends pruned recursively
+        self.exits = bytearray(dim * dim)
+        for c in range(dim * dim):
+            index = (2 * (c // dim) + 1) * walls_dim + 2 * (c % dim) + 1
+            self.exits[c] = sum(1 for offset in self.offset if not wall[index + offset])
+        self.prune_dead_ends(range(dim * dim))
+
+    def edge_corners(self, edge, across_rows):
+        """
+        Returns wall grid indices of both corners of the edge, which joins
+        them across rows of the wall grid if `across_rows` is set.
+        """
+
+        side = self.walls_dim if across_rows else 1
+        return edge - side, edge + side
+
+    def find_corner(self, corner):
+        corners = self.corners
+        while corners[corner] != corner:
+            corners[corner] = corners[corners[corner]]
+            corner = corners[corner]
+        return corner
+
+    def join_corners(self, a, b):
+        """
+        Joins sets of both corners. Returns False if they are joined
+        already, so the walls between them enclose a region.
+        """
+
+        a, b = self.find_corner(a), self.find_corner(b)
+        if a == b:
+            return False
+        self.corners[a] = b
         return True
 
+    def prune_wall(self, edge, cell, heading):
+        """
+        Updates pruning after a wall is learned on the edge of the cell in
+        the specific heading.
+        """
+
+        pruned, exits = self.pruned, self.exits
+        neighbour = cell + self.step[heading]
+        if pruned[cell] == Maze.Sealed:
+            return
+
+        # exits lead to cells which are not dead ends
+        if pruned[neighbour] != Maze.DeadEnd:
+            exits[cell] -= 1
+        if pruned[cell] != Maze.DeadEnd:
+            exits[neighbour] -= 1
+        self.prune_dead_ends((cell, neighbour))
+
+        # a wall between corners joined by walls splits cells in two parts
+        # (edges of up and down headings join corners in a row)
+        if not self.join_corners(*self.edge_corners(edge, heading % 2 == 0)):
+            self.prune_sealed(cell, neighbour)
+
+    def prune_dead_ends(self, cells):
+        """
+        Prunes cells with at most one exit and, recursively, cells left
+        with a single exit by them.
+        """
+
+        dim, walls_dim, wall, pruned, exits = self.dim, self.walls_dim, self.wall, self.pruned, self.exits
+        rest = list(cells)
+        while rest:
+            c = rest.pop()
+            if pruned[c] or exits[c] > 1 or c in self.protected:
+                continue
+            pruned[c] = Maze.DeadEnd
+            index = (2 * (c // dim) + 1) * walls_dim + 2 * (c % dim) + 1
+            for heading in range(len(headings)):
+                if not wall[index + self.offset[heading]]:
+                    neighbour = c + self.step[heading]
+                    exits[neighbour] -= 1
+                    rest.append(neighbour)
+
+    def prune_sealed(self, a, b):
+        """
+        Prunes the part which doesn't hold the init point, after a wall has
+        split cells `a` and `b` apart. Both parts are searched in turns, so
+        the work is proportional to the smaller one unless the init point
+        is there.
+        """
+
+        seen = [set([a]), set([b])]
+        rest = [[a], [b]]
+        while rest[0] and rest[1]:
+            for i in (0, 1):
+                for neighbour in self.open_neighbours(rest[i].pop()):
+                    if neighbour in seen[1 - i]:
+                        # still connected
+                        return
+                    if neighbour not in seen[i]:
+                        seen[i].add(neighbour)
+                        rest[i].append(neighbour)
+
+        closed = 0 if not rest[0] else 1
+        part = seen[closed]
+        if self.init in part:
+            part = self.component((a, b)[1 - closed])
+        for c in part:
+            if not self.pruned[c] and c not in self.protected:
+                self.pruned[c] = Maze.Sealed
+
+    def open_neighbours(self, c):
+        """
+        Returns cells, flattened as x * dim + y, across edges of the cell
+        not known to have a wall.
+        """
+
+        index = (2 * (c // self.dim) + 1) * self.walls_dim + 2 * (c % self.dim) + 1
+        return [c + step for step, offset in zip(self.step, self.offset) if not self.wall[index + offset]]
+
+    def component(self, c):
+        """
+        Returns set of cells connected to the cell by edges not known to
+        have a wall.
+        """
+
+        seen = set([c])
+        rest = [c]
+        while rest:
+            for neighbour in self.open_neighbours(rest.pop()):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    rest.append(neighbour)
+        return seen
+
+    def is_visited(self, cell):
+        """
+        Checks if a presence of the walls for the specific cell is known.
+        """
+
+        return self.unknown[cell[0] * self.dim + cell[1]] == 0
+
     def is_defined(self, cell, heading):
         """
         Maps the cell coordinates to wall coordinates and checks
         if a presence of the walls for the specific cell is known.
         """
 
-        move = heading_move[heading]
-        x_ = 2 * cell[0] + move[0]
-        y_ = 2 * cell[1] + move[1]
-        return not self.in_bound(x_, y_) or (x_, y_) in self.walls
+        return self.known[self.index(cell) + self.offset[heading]] == 1
 
     def is_permissible(self, cell, heading):
         """
@@ -197,14 +568,68 @@ class Maze(object):
         if move in the specific heading is allowed.
         """
 
-        move = heading_move[heading]
-        x_ = 2 * cell[0] + move[0]
-        y_ = 2 * cell[1] + move[1]
-        return self.in_bound(x_, y_) and not self.walls.get((x_, y_), None)
+        return self.wall[self.index(cell) + self.offset[heading]] == 0
+
+    def edges(self, grid, heading):
+        """
+        Returns (dim, dim) view of the grid with edges of every cell
+        in the specific heading.
+        """
+
+        move = heading_moves[heading]
+        return grid[1 + move[0]:self.walls_dim - 1 + move[0]:2, 1 + move[1]:self.walls_dim - 1 + move[1]:2]
+
+    def permissible_mask(self, heading):
+        """
+        Returns (dim, dim) boolean array of cells from which
+        move in the specific heading is allowed.
+        """
+
+        return self.edges(self.wall_grid, heading) == 0
+
+    def defined_mask(self, heading):
+        """
+        Returns (dim, dim) boolean array of cells which
+        wall in the specific heading is known.
+        """
+
+        return self.edges(self.known_grid, heading) == 1
+
+    def visited_mask(self):
+        """
+        Returns (dim, dim) boolean array of cells which walls are all known.
+        """
+
+        return self.unknown_grid == 0
+
+    def unvisited(self):
+        """
+        Returns list of cells which walls are not all known.
+        """
+
+        return np.argwhere(self.unknown_grid).tolist()
+
+    def unvisited_on(self, path):
+        """
+        Returns list of unvisited cells of the path, a sequence of cells
+        or (n, 2) array, in order of the path.
+        """
+
+        path = np.asarray(path, dtype=int).reshape(-1, 2)
+        return path[self.unknown_grid[path[:, 0], path[:, 1]] > 0].tolist()
 
-    def in_bound(self, x, y):
+    def nearest_unvisited(self, value):
         """
-        Checks if the wall coordinates are in the maze bounds.
+        Returns unvisited cell with the least value of (dim, dim) array of
+        distances, None if there is no unvisited cell with value below
+        `unreachable`. Pruned cells are skipped. Ties are broken by cell
+        coordinates.
         """
 
-        return 0 <= x <= self.walls_dim and 0 <= y <= self.walls_dim
+        value = np.where(self.unknown_grid > 0, value, unreachable)
+        if self.pruned is not None:
+            value[self.pruned_grid > 0] = unreachable
+        i = int(np.argmin(value))
+        if value.flat[i] >= unreachable:
+            return None
+        return [i / self.dim, i % self.dim]
@@ -1,4 +1,7 @@
 import importlib
+import threading
+import numpy as np
+from policy import compute_path, heading_rank, headings
 
 
 class Simulator(object):
@@ -56,22 +59,46 @@ class Simulator(object):
         'right': [(.4, 0), (-.4, .2), (-.4, -.2)],
     }
 
-    def __init__(self, maze, robot, delay=None, show_maze=False, show_policy=True):
+    def __init__(self, maze, robot, delay=None, show_maze=False, show_policy=True, headless=False, fps=None):
+        """
+        Window is opened if `delay` or `fps` is set; frames are paced by
+        the delay after every frame or to the frame rate. If `headless` is
+        set frames are rendered to an off-screen surface `screen` instead,
+        without delay.
+        """
+
         self.maze = maze
         self.robot = robot
         self.show_maze = show_maze
         self.show_policy = show_policy
 
+        # static layer and robot's data of the last frame
+        self.layer = None
+        self.known = None
+        self.wall = None
+        self.version = None
+        self.policy_moves = None
+        self.optimal_cells = set()
+        self.optimal_segments = set()
+        self.path_segments = set()
+        self.robot_state = None
+
+        self.headless = headless
+        self.fps = fps
         self.game = None
-        if delay:
+        if delay or headless or fps:
             try:
                 self.game = importlib.import_module('pygame')
                 self.game.init()
                 size = maze.dim * self.block_size + (maze.dim + 1) * self.line_width
-                self.screen = self.game.display.set_mode((size, size))
-                self.game.display.set_caption("Micromouse: " + self.maze.filename)
+                if headless:
+                    self.screen = self.game.Surface((size, size), 0, 32)
+                else:
+                    self.screen = self.game.display.set_mode((size, size))
+                    self.game.display.set_caption("Micromouse: " + self.maze.filename)
                 self.font = self.game.font.Font(None, 20)
                 self.frame_delay = max(1, delay)  # delay between frames in ms (min: 1)
+                self.clock = self.game.time.Clock()
             except Exception as e:
 
                 print 'Error initializing simulator; disabled.\n{}: {}'.format(e.__class__.__name__, e)
@@ -86,7 +113,7 @@ class Simulator(object):
         """
 
         # check for quit event
-        if self.game:
+        if self.game and not self.headless:
             for event in self.game.event.get():
                 if self.game and event.type == self.game.QUIT:
                     self.game.quit()
@@ -94,77 +121,165 @@ class Simulator(object):
 
         # draw environment
         if self.game:
-            # clear screen
-            self.screen.fill(self.maze_color)
-
-            # draw maze if show_maze is set to True
-            if self.show_maze:
-                self.render_maze()
-
-            # draw robot data
-            self.render_robot_data()
-
-            # draw robot pos
-            self.render_robot_shape()
+            if self.layer is None:
+                self.layer = self.render_layer()
 
-            # replace buffer
-            self.game.display.flip()
+            # redraw changed cells only and update their screen areas
+            rects = self.render_changes()
+            if self.headless:
+                return
+            if rects:
+                self.game.display.update(rects)
 
             # apply frame delay
-            self.game.time.wait(self.frame_delay)
+            if self.fps:
+                self.clock.tick(self.fps)
+            else:
+                self.game.time.wait(self.frame_delay)
 
-    def render_maze(self):
+    def render_layer(self):
         """
-        Iterates through cells one by one to decide where to draw walls.
+        Draws static part of the picture to an off-screen surface:
+        background, the maze if show_maze is set to True, and the goal.
         """
 
-        for x in range(self.maze.dim):
-            for y in range(self.maze.dim):
-                for heading in self.heading_label:
-                    if not self.maze.is_permissible([x, y], heading):
-                        self.render_wall(x, y, heading, self.hidden_wall_color)
+        layer = self.game.Surface(self.screen.get_size(), 0, self.screen)
+        layer.fill(self.maze_color)
+
+        # draw maze if show_maze is set to True
+        if self.show_maze:
+            for x in range(self.maze.dim):
+                for y in range(self.maze.dim):
+                    for heading in self.heading_label:
+                        if not self.maze.is_permissible([x, y], heading):
+                            self.render_wall(x, y, heading, self.hidden_wall_color, layer)
 
-    def render_robot_data(self):
+        # goal
+        for goal in self.robot.goals:
+            self.game.draw.rect(layer, self.goal_color, self.cell_points(goal))
+
+        return layer
+
+    def render_changes(self):
         """
-        Draws robot's policy, spotted walls and the goal.
+        Redraws cells which robot's data changed since the last frame, with
+        paths and robot's shape over them. Returns list of redrawn areas.
         """
 
-        for x in range(self.maze.dim):
-            for y in range(self.maze.dim):
-                next_cell = (x, y)
+        dirty = self.find_dirty_cells()
+        touched = set(dirty)
 
-                # visited
-                if self.robot.maze.is_visited(next_cell):
-                    center = self.center(next_cell)
-                    points = [center[0] - .5 * self.block_size, center[1] - .5 * self.block_size,
-                              self.block_size, self.block_size]
-                    self.game.draw.rect(self.screen, self.visited_color, points)
+        goals = set(tuple(goal) for goal in self.robot.goals)
+        for cell in dirty:
+            self.render_cell(cell, cell in goals)
 
-                # policy
-                if self.show_policy and self.robot.policy and self.robot.policy[x][y]:
-                    center = self.center(next_cell)
-                    heading, movement, _ = self.robot.policy[x][y]
-                    color = self.optimal_color if [x, y] in self.robot.optimal else self.policy_color
-                    label = self.font.render(self.heading_label[heading] + "{}".format(movement), 1, color)
-                    self.screen.blit(label, [center[0] - label.get_width() / 2, center[1] - label.get_height() / 2])
+        # optimal path over the redrawn cells, current path over both
+        for segments, color in ((self.optimal_segments, self.optimal_color),
+                                (self.path_segments, self.path_color)):
+            for segment in segments:
+                cells = self.segment_cells(segment)
+                if not touched.isdisjoint(cells):
+                    touched.update(cells)
+                    self.game.draw.line(self.screen, color, self.center(segment[0]), self.center(segment[1]),
+                                        self.line_width)
 
-                # walls
-                for heading in self.heading_label:
-                    if not self.robot.maze.is_permissible(next_cell, heading):
-                        self.render_wall(x, y, heading, self.known_wall_color)
+        # draw robot pos
+        self.render_robot_shape()
+        touched.add(self.robot_state[0])
 
-        # goal
-        for goal in self.robot.goals:
-            center = self.center(goal)
-            points = [center[0] - .5 * self.block_size, center[1] - .5 * self.block_size,
-                      self.block_size, self.block_size]
-            self.game.draw.rect(self.screen, self.goal_color, points)
+        return [self.cell_rect(cell) for cell in touched]
 
-        # optimal path
-        self.render_path(self.robot.optimal, self.optimal_color)
+    def find_dirty_cells(self):
+        """
+        Compares robot's data with the data of the last frame and returns
+        set of cells which look has changed: known walls, policy labels,
+        path segments and robot position. All cells are dirty on the first
+        frame.
+        """
+
+        robot = self.robot
+        dim = self.maze.dim
+        known = robot.maze.known_grid.copy()
+        wall = robot.maze.wall_grid.copy()
+        optimal_segments = self.path_segments_of(robot.optimal)
+        path_segments = self.path_segments_of(robot.path)
+        optimal_cells = set(tuple(cell) for cell in robot.optimal.tolist())
+        robot_state = ((robot.location[0], robot.location[1]), robot.heading)
+
+        if self.known is None:
+            dirty = set((x, y) for x in range(dim) for y in range(dim))
+            if self.show_policy:
+                self.policy_moves = (robot.policy.heading_grid.copy(), robot.policy.movement_grid.copy())
+        else:
+            dirty = set()
+
+            # cells on both sides of every changed edge
+            for i, j in np.argwhere((known != self.known) | (wall != self.wall)).tolist():
+                if i % 2:
+                    cells = ((i / 2, j / 2 - 1), (i / 2, j / 2))
+                else:
+                    cells = ((i / 2 - 1, j / 2), (i / 2, j / 2))
+                for x, y in cells:
+                    if 0 <= x < dim and 0 <= y < dim:
+                        dirty.add((x, y))
+
+            # changed segments of both paths
+            for segment in (optimal_segments ^ self.optimal_segments) | (path_segments ^ self.path_segments):
+                dirty.update(self.segment_cells(segment))
+
+            # robot pos
+            if robot_state != self.robot_state:
+                dirty.add(self.robot_state[0])
+                dirty.add(robot_state[0])
+
+            # policy labels, which change only with maze walls, and their colors
+            if self.show_policy:
+                if robot.maze.version != self.version:
+                    heading, movement = robot.policy.heading_grid, robot.policy.movement_grid
+                    changed = (heading != self.policy_moves[0]) | (movement != self.policy_moves[1])
+                    for x, y in np.argwhere(changed).tolist():
+                        dirty.add((x, y))
+                    self.policy_moves = (heading.copy(), movement.copy())
+                dirty.update(optimal_cells ^ self.optimal_cells)
+
+        self.known, self.wall = known, wall
+        self.version = robot.maze.version
+        self.optimal_segments, self.path_segments = optimal_segments, path_segments
+        self.optimal_cells = optimal_cells
+        self.robot_state = robot_state
+
+        return dirty
+
+    def render_cell(self, cell, is_goal):
+        """
+        Restores the static layer for the cell and its walls and draws
+        robot's data for it: visited state, policy and spotted walls.
+        """
 
-        # current path
-        self.render_path(self.robot.path, self.path_color)
+        x, y = cell
+        rect = self.cell_rect(cell)
+        self.screen.blit(self.layer, rect, rect)
+
+        if not is_goal:
+            # visited
+            if self.robot.maze.is_visited(cell):
+                self.game.draw.rect(self.screen, self.visited_color, self.cell_points(cell))
+
+            # policy
+            entry = self.robot.policy.entry(cell) if self.show_policy else None
+            if entry:
+                center = self.center(cell)
+                heading, movement, _ = entry
+                color = self.optimal_color if cell in self.optimal_cells else self.policy_color
+                label = self.font.render(self.heading_label[heading] + "{}".format(movement), 1, color)
+                self.screen.blit(label, [center[0] - label.get_width() / 2, center[1] - label.get_height() / 2])
+
+        # walls of the cell and neighbour's walls touching its corners
+        for x2, y2 in ((x, y), (x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 <= x2 < self.maze.dim and 0 <= y2 < self.maze.dim:
+                for heading in self.heading_label:
+                    if not self.robot.maze.is_permissible((x2, y2), heading_rank[heading]):
+                        self.render_wall(x2, y2, heading, self.known_wall_color)
 
     def render_robot_shape(self):
         """
@@ -172,45 +287,72 @@ class Simulator(object):
         """
 
         points = []
-        heading = self.robot.heading
+        heading = headings[self.robot.heading]
         center = self.center(self.robot.location)
         for p in self.robot_shape[heading]:
             points.append((center[0] + p[0] * self.block_size, center[1] + p[1] * self.block_size))
 
         self.game.draw.polygon(self.screen, self.robot_color, points)
 
-    def render_path(self, path, color):
+    def path_segments_of(self, path):
+        """
+        Returns set of segments, pairs of consecutive cells, of the path.
+        """
+
+        cells = [tuple(cell) for cell in path.tolist()]
+        return set(zip(cells, cells[1:]))
+
+    def segment_cells(self, segment):
+        """
+        Returns all cells of a straight segment.
+        """
+
+        (x1, y1), (x2, y2) = segment
+        if x1 == x2:
+            return [(x1, y) for y in range(min(y1, y2), max(y1, y2) + 1)]
+        return [(x, y1) for x in range(min(x1, x2), max(x1, x2) + 1)]
+
+    def cell_points(self, cell):
         """
-        Draws the path in given color.
+        Returns rect of the cell's area inside its walls.
         """
 
-        cell = None
-        for next_cell in path:
-            if cell:
-                p1 = self.center(cell)
-                p2 = self.center(next_cell)
-                self.game.draw.line(self.screen, color, p1, p2, self.line_width)
-            cell = next_cell
+        center = self.center(cell)
+        return [center[0] - .5 * self.block_size, center[1] - .5 * self.block_size,
+                self.block_size, self.block_size]
 
-    def render_wall(self, x, y, side, color):
+    def cell_rect(self, cell):
         """
-        Renders wall for given cell in the maze and side of the wall.
+        Returns rect of the cell's area along with its walls.
         """
 
+        left, top = self.transform(cell[0], cell[1])
+        size = self.block_size + 2 * self.line_width
+        return self.game.Rect(left, top, size, size)
+
+    def render_wall(self, x, y, side, color, surface=None):
+        """
+        Renders wall for given cell in the maze and side of the wall,
+        on the screen unless other surface is given.
+        """
+
+        if surface is None:
+            surface = self.screen
+
         if side == 'up':
-            self.game.draw.line(self.screen, color,
+            self.game.draw.line(surface, color,
                                 self.transform(x, y + 1), self.transform(x + 1, y + 1),
                                 self.line_width)
         elif side == 'right':
-            self.game.draw.line(self.screen, color,
+            self.game.draw.line(surface, color,
                                 self.transform(x + 1, y), self.transform(x + 1, y + 1),
                                 self.line_width)
         elif side == 'down':
-            self.game.draw.line(self.screen, color,
+            self.game.draw.line(surface, color,
                                 self.transform(x, y), self.transform(x + 1, y),
                                 self.line_width)
         elif side == 'left':
-            self.game.draw.line(self.screen, color,
+            self.game.draw.line(surface, color,
                                 self.transform(x, y), self.transform(x, y + 1),
                                 self.line_width)
 
@@ -228,3 +370,101 @@ class Simulator(object):
         """
 
         return x * (self.block_size + self.line_width), y * (self.block_size + self.line_width)
+
+
+class Snapshot(object):
+    """
+    Immutable copy of robot's data shown by Simulator, taken after a move.
+    Only the wall grids and the frontier index of the maze are copied. Policy
+    is copied too, or taken from the `previous` snapshot if the robot's
+    policy and maze version haven't changed since; other policies are cached
+    by the robot unmodified and shared. Paths are computed on first access.
+    """
+
+    def __init__(self, robot, previous=None):
+        self.init = robot.init
+        self.goals = robot.goals
+        self.maze = robot.maze.copy_walls()
+        self.source = robot.policy
+        if previous and previous.source is robot.policy and previous.maze.version == robot.maze.version:
+            self.policy = previous.policy
+        else:
+            self.policy = robot.policy.copy()
+        self.current_policy = robot.current_policy
+        if self.current_policy is robot.policy:
+            self.current_policy = self.policy
+        self.location = list(robot.location)
+        self.heading = robot.heading
+        self._optimal = None
+        self._path = None
+
+    @property
+    def optimal(self):
+        if self._optimal is None:
+            self._optimal = compute_path(self.policy, self.init)
+        return self._optimal
+
+    @property
+    def path(self):
+        if self._path is None:
+            if self.current_policy:
+                self._path = compute_path(self.current_policy, self.location)
+            else:
+                self._path = np.zeros((0, 2), dtype=int)
+        return self._path
+
+
+class RenderThread(object):
+    """
+    Shows robot's data in a background thread at a fixed frame rate, so the
+    trial runs at full speed. `render` only publishes a snapshot of the
+    robot, and only once the renderer has taken the previous one, so moves
+    between frames cost no copies. Closing the window stops the renderer
+    only.
+
+    PyGame is used from the renderer thread only, which some platforms
+    (macOS) don't support.
+    """
+
+    def __init__(self, maze, robot, fps=30, show_maze=False, show_policy=True):
+        self.robot = robot
+        self.latest = Snapshot(robot)
+        self.taken = False
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(maze, fps, show_maze, show_policy))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def render(self, force=False):
+        """
+        Publishes current robot's data to the renderer, if it has taken the
+        previous snapshot or `force` is set.
+        """
+
+        if self.running and (self.taken or force):
+            self.taken = False
+            self.latest = Snapshot(self.robot, self.latest)
+
+    def run(self, maze, fps, show_maze, show_policy):
+        simulator = Simulator(maze, self.latest, show_maze=show_maze, show_policy=show_policy, fps=fps)
+        while self.running and simulator.game:
+            simulator.robot = self.latest
+            self.taken = True
+            simulator.render()
+        self.running = False
+
+    def join(self):
+        """
+        Waits until the window is closed.
+        """
+
+        while self.thread.is_alive():
+            self.thread.join(.1)
+
+    def close(self):
+        """
+        Stops the renderer.
+        """
+
+        self.running = False
+        self.thread.join()
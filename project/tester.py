@@ -1,8 +1,11 @@
+import os
 import sys
+from collections import namedtuple
 from maze import Maze
 from robot import Robot
-from simulator import Simulator
 from policy import estimate_score
+from knowledge import knowledge_filename, load_knowledge, save_knowledge
+from recorder import Trace
 
 # global dictionaries for robot movement and sensing
 dir_sensors = {'up': ['left', 'up', 'right'], 'right': ['up', 'right', 'down'],
@@ -14,6 +17,160 @@ dir_reverse = {'up': 'down', 'right': 'left', 'down': 'up', 'left': 'right'}
 max_time = 1000
 train_score_ratio = 1 / 30.
 
+# outcome of a trial: time spent on every completed run, score (None if the
+# task is not completed), number of time steps used, whether the goal was hit
+# on the last run and recorded Trace (None if not requested)
+TrialResult = namedtuple('TrialResult', ['runtimes', 'score', 'steps', 'hit_goal', 'trace'])
+
+
+def run_trial(maze, robot_factory=Robot, max_time=max_time, delay=None, show_maze=False,
+              show_policy=False, trace=False, knowledge=None, log=None, fps=None, wait=False):
+    """
+    Tests a robot on the maze over two runs and returns TrialResult.
+
+    The robot is created by `robot_factory` called with maze dimensions, init
+    point and goal bounds. Both runs share `max_time` time steps. A simulator
+    is created only if `delay` is set. If `fps` is set instead, frames are
+    drawn by RenderThread at that rate while the trial runs at full speed;
+    at the end of the trial the renderer is stopped, or if `wait` is set,
+    the trial returns when its window is closed. Progress messages are
+    passed to `log` callable, if given. If `trace` is set, every move is
+    recorded to Trace with the robot position after the move and walls the
+    robot learned, read from its `learned` attribute if it has one.
+
+    If `knowledge` directory is given, the robot starts with walls and
+    policy learned in the same maze earlier, if any, and what it knows at
+    the end of the trial is saved there. This requires robot's `restore`.
+    """
+
+    init = [0, 0]
+    goal_bounds = [maze.dim / 2 - 1, maze.dim / 2]
+
+    # initialize a robot; robot receives info about maze dimensions.
+    robot = robot_factory(maze.dim, init, goal_bounds)
+    if knowledge:
+        if not os.path.isdir(knowledge):
+            os.makedirs(knowledge)
+        if os.path.exists(knowledge_filename(knowledge, maze)):
+            load_knowledge(knowledge_filename(knowledge, maze), robot)
+
+    # create a simulator to display maze and robot movements.
+    simulator = None
+    if delay:
+        from simulator import Simulator
+        simulator = Simulator(maze, robot, delay=delay, show_maze=show_maze, show_policy=show_policy)
+    elif fps:
+        from simulator import RenderThread
+        simulator = RenderThread(maze, robot, fps=fps, show_maze=show_maze, show_policy=show_policy)
+
+    # record robot performance over two runs.
+    runtimes = []
+    recorder = Trace(maze, [[x, y] for x in goal_bounds for y in goal_bounds]) if trace else None
+    total_time = 0
+    hit_goal = False
+    try:
+        for run in range(2):
+            if log:
+                log('Starting run {}.'.format(run))
+
+            # set the robot in the start position. Note that robot position
+            # parameters are independent of the robot itself.
+            location = [init[0], init[1]]
+            heading = 'up'
+
+            hit_goal = False
+            while True:
+                # check for end of time
+                total_time += 1
+                if total_time > max_time:
+                    if log:
+                        log('Allotted time exceeded.')
+                    break
+
+                # provide robot with sensor information, get actions
+                sensing = [maze.dist_to_wall(location, sensor) for sensor in dir_sensors[heading]]
+                rotation, movement = robot.next_move(sensing)
+
+                # render simulator
+                if simulator:
+                    simulator.render()
+
+                # check for a reset
+                if (rotation, movement) == ('Reset', 'Reset'):
+                    if trace:
+                        recorder.append(run, location, heading, rotation, movement, getattr(robot, 'learned', ()))
+                    if run == 0 and hit_goal:
+                        runtimes.append(total_time)
+                        if log:
+                            log('Ending first run. Starting next run.')
+                        break
+                    elif log and run == 0 and not hit_goal:
+                        log('Cannot reset - robot has not hit goal yet.')
+                    elif log:
+                        log('Cannot reset on runs after the first.')
+                    continue
+
+                # perform rotation
+                if rotation == -90:
+                    heading = dir_sensors[heading][0]
+                elif rotation == 90:
+                    heading = dir_sensors[heading][2]
+                elif rotation != 0 and log:
+                    log('Invalid rotation value, no rotation performed.')
+
+                # perform movement
+                if abs(movement) > 3 and log:
+                    log('Movement limited to three squares in a turn.')
+                movement = max(min(int(movement), 3), -3)  # fix to range [-3, 3]
+                direction = heading if movement > 0 else dir_reverse[heading]
+                distance = min(abs(movement), maze.dist_to_wall(location, direction))
+                if distance < abs(movement) and log:
+                    log('Movement stopped by wall.')
+                location[0] += distance * dir_move[direction][0]
+                location[1] += distance * dir_move[direction][1]
+
+                if trace:
+                    recorder.append(run, location, heading, rotation, movement, getattr(robot, 'learned', ()))
+
+                # check for goal entered
+                if location[0] in goal_bounds and location[1] in goal_bounds:
+                    hit_goal = True
+                    if run != 0:
+                        runtimes.append(total_time - sum(runtimes))
+                        if log:
+                            log('Goal found; run {} completed!'.format(run))
+                        break
+    finally:
+        # keep learned walls, also of an interrupted trial
+        if knowledge:
+            save_knowledge(knowledge_filename(knowledge, maze), robot)
+
+    score = None
+    if len(runtimes) == 2:
+        score = runtimes[1] + train_score_ratio * runtimes[0]
+    if simulator and not delay:
+        simulator.render(force=True)
+        if wait:
+            if log:
+                log('Trial ended with score {}, close the window to continue.'.format(score))
+            simulator.join()
+        else:
+            simulator.close()
+
+    if trace:
+        recorder.finish()
+
+    return TrialResult(runtimes, score, min(total_time, max_time), hit_goal, recorder)
+
+
+def print_log(message):
+    """
+    Prints trial progress message.
+    """
+
+    print message
+
+
 if __name__ == '__main__':
     '''
     This script tests a robot based on the code in robot.py on a maze given
@@ -25,106 +182,24 @@ if __name__ == '__main__':
     init = [0, 0]
     goal_bounds = [testmaze.dim / 2 - 1, testmaze.dim / 2]
 
-    # initialize a robot; robot receives info about maze dimensions.
-    testrobot = Robot(testmaze.dim, init, goal_bounds)
-
-    # create a simulator to display maze and robot movements.
-    # set delay to None to disable simulator.
+    # set delay to None or 0 to disable simulator; frames are drawn in the
+    # background at a fixed frame rate instead if it is given.
     delay = None
     if len(sys.argv) > 2:
         delay = int(sys.argv[2])
     show_maze = False
     if len(sys.argv) > 3:
         show_maze = bool(sys.argv[3])
-    simulator = Simulator(testmaze, testrobot, delay=delay, show_maze=show_maze, show_policy=False)
+    fps = None
+    if len(sys.argv) > 4:
+        fps = int(sys.argv[4])
 
     # print estimated score
     best_score, worst_score = estimate_score(testmaze, init, goal_bounds, train_score_ratio)
     print "Estimated score is between {:4.3f} and {:4.3f}".format(best_score, worst_score)
 
-    # record robot performance over two runs.
-    runtimes = []
-    total_time = 0
-    for run in range(2):
-        print 'Starting run {}.'.format(run)
-
-        # set the robot in the start position. Note that robot position
-        # parameters are independent of the robot itself.
-        robot_pos = {'location': [init[0], init[1]], 'heading': 'up'}
-
-        run_active = True
-        hit_goal = False
-        while run_active:
-            # check for end of time
-            total_time += 1
-            if total_time > max_time:
-                run_active = False
-                print 'Allotted time exceeded.'
-                break
-
-            # provide robot with sensor information, get actions
-            sensing = [testmaze.dist_to_wall(robot_pos['location'], heading)
-                       for heading in dir_sensors[robot_pos['heading']]]
-            rotation, movement = testrobot.next_move(sensing)
-
-            # render simulator
-            simulator.render()
-
-            # check for a reset
-            if (rotation, movement) == ('Reset', 'Reset'):
-                if run == 0 and hit_goal:
-                    run_active = False
-                    runtimes.append(total_time)
-                    print 'Ending first run. Starting next run.'
-                    break
-                elif run == 0 and not hit_goal:
-                    print 'Cannot reset - robot has not hit goal yet.'
-                    continue
-                else:
-                    print 'Cannot reset on runs after the first.'
-                    continue
-
-            # perform rotation
-            if rotation == -90:
-                robot_pos['heading'] = dir_sensors[robot_pos['heading']][0]
-            elif rotation == 90:
-                robot_pos['heading'] = dir_sensors[robot_pos['heading']][2]
-            elif rotation == 0:
-                pass
-            else:
-                print 'Invalid rotation value, no rotation performed.'
-
-            # perform movement
-            if abs(movement) > 3:
-                print 'Movement limited to three squares in a turn.'
-            movement = max(min(int(movement), 3), -3)  # fix to range [-3, 3]
-            while movement:
-                if movement > 0:
-                    if testmaze.is_permissible(robot_pos['location'], robot_pos['heading']):
-                        robot_pos['location'][0] += dir_move[robot_pos['heading']][0]
-                        robot_pos['location'][1] += dir_move[robot_pos['heading']][1]
-                        movement -= 1
-                    else:
-                        print 'Movement stopped by wall.'
-                        movement = 0
-                else:
-                    rev_heading = dir_reverse[robot_pos['heading']]
-                    if testmaze.is_permissible(robot_pos['location'], rev_heading):
-                        robot_pos['location'][0] += dir_move[rev_heading][0]
-                        robot_pos['location'][1] += dir_move[rev_heading][1]
-                        movement += 1
-                    else:
-                        print 'Movement stopped by wall.'
-                        movement = 0
-
-            # check for goal entered
-            if robot_pos['location'][0] in goal_bounds and robot_pos['location'][1] in goal_bounds:
-                hit_goal = True
-                if run != 0:
-                    runtimes.append(total_time - sum(runtimes))
-                    run_active = False
-                    print 'Goal found; run {} completed!'.format(run)
+    result = run_trial(testmaze, Robot, delay=delay, show_maze=show_maze, log=print_log, fps=fps, wait=True)
 
     # report score if robot is successful.
-    if len(runtimes) == 2:
-        print 'Task complete! Score: {:4.3f}'.format(runtimes[1] + train_score_ratio * runtimes[0])
+    if result.score is not None:
+        print 'Task complete! Score: {:4.3f}'.format(result.score)
@@ -0,0 +1,426 @@
+import argparse
+import time
+import numpy as np
+from maze import Maze
+from policy import heading_move, headings, max_movement, unreachable
+from tester import max_time, train_score_ratio
+
+# moves in every heading, indexed as `headings`
+moves = np.array([heading_move[heading] for heading in headings])
+
+# rotation values and sensors facing the new heading by change of heading
+# index: none, clockwise, reversed (a backward move), counterclockwise
+rotation_values = np.array([0, 90, 0, -90])
+rotation_sensors = np.array([1, 2, 1, 0])
+
+
+class Lanes(object):
+    """
+    Runs N trials in lockstep under the tester rules, one lane per maze.
+    All mazes must have the same dimensions.
+
+    Lane state is held in arrays: location (N, 2), heading (N,) as index in
+    `headings`, run, time, runtimes (N, 2) and flags of hit goal and of
+    finished lanes. A lane is finished when its second run is completed or
+    its `max_time` time steps are exhausted; finished lanes ignore actions.
+    """
+
+    def __init__(self, mazes, max_time=max_time):
+        dims = set(maze.dim for maze in mazes)
+        if len(dims) != 1:
+            raise Exception('All mazes must have the same dimensions!')
+
+        self.mazes = list(mazes)
+        self.size = len(mazes)
+        self.dim = dims.pop()
+        self.max_time = max_time
+        self.goal_bounds = [self.dim / 2 - 1, self.dim / 2]
+        self.lanes = np.arange(self.size)
+
+        # open run lengths of all mazes, (N, dim, dim, 4)
+        self.runs = np.stack([maze.runs for maze in mazes])
+
+        self.reset()
+
+    def reset(self, lanes=None):
+        """
+        Sets lanes given as a mask, or every lane, to the start of the
+        first run.
+        """
+
+        if lanes is None:
+            self.location = np.zeros((self.size, 2), dtype=int)
+            self.heading = np.zeros(self.size, dtype=int)
+            self.run = np.zeros(self.size, dtype=int)
+            self.time = np.zeros(self.size, dtype=int)
+            self.runtimes = np.zeros((self.size, 2), dtype=int)
+            self.hit_goal = np.zeros(self.size, dtype=bool)
+            self.done = np.zeros(self.size, dtype=bool)
+        else:
+            for state in (self.location, self.heading, self.run, self.time, self.runtimes, self.hit_goal, self.done):
+                state[lanes] = 0
+
+    def load(self, lane, maze):
+        """
+        Replaces the maze of the lane with another maze of the same
+        dimensions. Lane state is not reset.
+        """
+
+        if maze.dim != self.dim:
+            raise Exception('All mazes must have the same dimensions!')
+        self.mazes[lane] = maze
+        self.runs[lane] = maze.runs
+
+    def sense(self):
+        """
+        Returns (N, 3) array of distances from the left, front and
+        right-facing sensors of every lane.
+        """
+
+        sides = (self.heading[:, None] + np.array([-1, 0, 1])) % 4
+        x, y = self.location[:, 0], self.location[:, 1]
+        return self.runs[self.lanes[:, None], x[:, None], y[:, None], sides]
+
+    def in_goal(self):
+        """
+        Returns (N,) boolean array of lanes which location is in the goal.
+        """
+
+        low, high = self.goal_bounds
+        return ((self.location >= low) & (self.location <= high)).all(axis=1)
+
+    def step(self, rotation, movement, reset):
+        """
+        Advances every unfinished lane by one time step. Rotation (-90, 0 or
+        90, other values mean no rotation) and movement (clamped to [-3, 3])
+        are given as (N,) arrays, `reset` marks lanes which return
+        ('Reset', 'Reset'). Returns (N,) boolean array of lanes which have
+        been active on this step.
+        """
+
+        active = ~self.done
+        self.time[active] += 1
+        expired = active & (self.time > self.max_time)
+        self.time[expired] = self.max_time
+        self.done |= expired
+        active &= ~expired
+
+        # reset is accepted on the first run after the goal has been hit
+        reset = active & reset
+        accepted = reset & (self.run == 0) & self.hit_goal
+        self.runtimes[accepted, 0] = self.time[accepted]
+        self.run[accepted] = 1
+        self.location[accepted] = 0
+        self.heading[accepted] = 0
+        self.hit_goal[accepted] = False
+
+        # rotate, then move until stopped by a wall
+        moving = active & ~reset
+        self.heading[moving & (rotation == 90)] += 1
+        self.heading[moving & (rotation == -90)] -= 1
+        self.heading %= 4
+        movement = np.clip(movement, -max_movement, max_movement)
+        direction = np.where(movement < 0, (self.heading + 2) % 4, self.heading)
+        x, y = self.location[:, 0], self.location[:, 1]
+        distance = np.minimum(np.abs(movement), self.runs[self.lanes, x, y, direction])
+        distance[~moving] = 0
+        self.location += distance[:, None] * moves[direction]
+
+        # goal is entered
+        entered = moving & self.in_goal()
+        self.hit_goal |= entered
+        completed = entered & (self.run == 1)
+        self.runtimes[completed, 1] = self.time[completed] - self.runtimes[completed, 0]
+        self.done |= completed
+
+        return active
+
+    def scores(self):
+        """
+        Returns (N,) array of scores, NaN for lanes which haven't
+        completed the task.
+        """
+
+        completed = self.runtimes[:, 1] > 0
+        score = self.runtimes[:, 1] + train_score_ratio * self.runtimes[:, 0]
+        return np.where(completed, score, np.nan)
+
+
+class Robots(object):
+    """
+    Vectorized version of the default robot for N lanes: explores by
+    following the optimal policy to reach the goal over its knowledge
+    (unknown edges are treated as open), resets as soon as the goal is
+    reached and follows the policy again on the second run. The phase
+    validating the solution path is skipped.
+
+    Knowledge is kept in (N, walls_dim ** 2) byte grids laid out as in
+    robot.Maze. Policy (value, heading, movement over flattened cells) is
+    recomputed with a batched wavefront only for lanes which path from the
+    current location crosses a new wall: a policy can only get worse as
+    walls are learned, so a path which stays open remains optimal and
+    policy entries along it don't change.
+    """
+
+    def __init__(self, size, dim):
+        self.size = size
+        self.dim = dim
+        self.walls_dim = 2 * dim + 1
+        self.goal_bounds = [dim / 2 - 1, dim / 2]
+        self.lanes = np.arange(size)
+
+        # offsets of the edge in every heading in wall grids and of the
+        # neighbour cell in flattened cells
+        self.offset = moves[:, 0] * self.walls_dim + moves[:, 1]
+        self.step = moves[:, 0] * dim + moves[:, 1]
+
+        goals = np.zeros((dim, dim), dtype=bool)
+        goals[self.goal_bounds[0]:self.goal_bounds[1] + 1, self.goal_bounds[0]:self.goal_bounds[1] + 1] = True
+        self.goals = goals.ravel()
+
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets learned walls and starts exploration in every lane.
+        """
+
+        size, walls_dim = self.size, self.walls_dim
+        self.known = np.zeros((size, walls_dim, walls_dim), dtype=np.uint8)
+        self.wall = np.zeros((size, walls_dim, walls_dim), dtype=np.uint8)
+        for grid in (self.known, self.wall):
+            grid[:, [0, -1], :] = 1
+            grid[:, :, [0, -1]] = 1
+        self.known = self.known.reshape(size, -1)
+        self.wall = self.wall.reshape(size, -1)
+
+        self.location = np.zeros((size, 2), dtype=int)
+        self.heading = np.zeros(size, dtype=int)
+        self.testing = np.zeros(size, dtype=bool)
+
+        cells = self.dim * self.dim
+        self.value = np.full((size, cells), unreachable, dtype=np.int32)
+        self.policy_heading = np.full((size, cells), -1, dtype=np.int8)
+        self.policy_movement = np.zeros((size, cells), dtype=np.int8)
+        self.planned = np.zeros(size, dtype=bool)
+
+    def cells(self):
+        """
+        Returns flattened cell of every lane's location.
+        """
+
+        return self.location[:, 0] * self.dim + self.location[:, 1]
+
+    def next_moves(self, sensors, active):
+        """
+        Chooses moves of `active` lanes given (N, 3) sensor readings.
+        Returns (N,) arrays of rotation, movement and reset flags.
+        """
+
+        learned = self.learn(sensors, active)
+
+        # goal is reached in `exploring` phase, switch to `testing` phase
+        low, high = self.goal_bounds
+        reset = active & ~self.testing & ((self.location >= low) & (self.location <= high)).all(axis=1)
+        self.testing |= reset
+        self.location[reset] = 0
+        self.heading[reset] = 0
+        self.planned[reset] = False
+
+        # replan lanes which path is blocked
+        moving = active & ~reset
+        self.planned[moving & learned & ~self.is_open(moving & learned & self.planned)] = False
+        self.plan(moving & ~self.planned)
+
+        # follow the policy; reversed heading is a backward move
+        cell = self.cells()
+        heading = self.policy_heading[self.lanes, cell].astype(int)
+        movement = self.policy_movement[self.lanes, cell].astype(int)
+        turn = (heading - self.heading) % 4
+        rotation = rotation_values[turn]
+        reverse = turn == 2
+        movement[reverse] *= -1
+
+        # update position as the robot sees it: forward moves are limited by the sensor
+        distance = np.where(reverse, -movement, np.minimum(sensors[self.lanes, rotation_sensors[turn]], movement))
+        distance[~moving] = 0
+        self.heading = np.where(moving & ~reverse, heading, self.heading)
+        self.location += distance[:, None] * moves[heading]
+
+        rotation[~moving] = 0
+        movement[~moving] = 0
+        return rotation, movement, reset
+
+    def learn(self, sensors, active):
+        """
+        Stores open edges and walls along sensor rays of `active` lanes.
+        Returns (N,) boolean array of lanes which learned new walls.
+        """
+
+        learned = np.zeros(self.size, dtype=bool)
+        base = (2 * self.location[:, 0] + 1) * self.walls_dim + 2 * self.location[:, 1] + 1
+        for s in range(3):
+            side = (self.heading + s - 1) % 4
+            length = sensors[:, s]
+            start = base + self.offset[side]
+            step = 2 * self.offset[side]
+            for i in range(int(length[active].max()) + 1 if active.any() else 0):
+                lanes = self.lanes[active & (length >= i)]
+                edges = start[lanes] + i * step[lanes]
+                self.known[lanes, edges] = 1
+                ends = lanes[length[lanes] == i]
+                walls = edges[length[lanes] == i]
+                learned[ends[self.wall[ends, walls] == 0]] = True
+                self.wall[ends, walls] = 1
+
+        return learned
+
+    def is_open(self, lanes):
+        """
+        Follows the policy from the location of the lanes (given as a mask)
+        to the goal. Returns (N,) boolean array which is False for the lanes
+        which path crosses a wall.
+        """
+
+        is_open = np.ones(self.size, dtype=bool)
+        lanes = self.lanes[lanes]
+        cells = self.cells()[lanes]
+        while lanes.size:
+            heading = self.policy_heading[lanes, cells].astype(int)
+            ongoing = heading >= 0
+            lanes, cells, heading = lanes[ongoing], cells[ongoing], heading[ongoing]
+            movement = self.policy_movement[lanes, cells].astype(int)
+            x, y = cells / self.dim, cells % self.dim
+            edge = (2 * x + 1) * self.walls_dim + 2 * y + 1 + self.offset[heading]
+            blocked = np.zeros(lanes.size, dtype=bool)
+            for i in range(max_movement):
+                crossed = movement > i
+                edges = edge[crossed] + 2 * i * self.offset[heading[crossed]]
+                blocked[crossed] |= self.wall[lanes[crossed], edges] == 1
+            is_open[lanes[blocked]] = False
+            lanes, cells = lanes[~blocked], cells[~blocked] + movement[~blocked] * self.step[heading[~blocked]]
+
+        return is_open
+
+    def plan(self, lanes):
+        """
+        Recomputes policy of the lanes (given as a mask) with a batched
+        wavefront from the goal, as `policy.compute_wavefront` does for a
+        single maze, until the location of every lane is reached.
+        """
+
+        lanes = self.lanes[lanes]
+        if not lanes.size:
+            return
+
+        dim, walls_dim = self.dim, self.walls_dim
+        count, cells = lanes.size, dim * dim
+        rows = [(movement, heading) for movement in range(1, max_movement + 1) for heading in range(len(headings))]
+
+        # lanes' cells from which every (movement, heading) row of straight moves is allowed
+        wall = self.wall[lanes].reshape(count, walls_dim, walls_dim)
+        runs = np.zeros((len(rows), count, cells), dtype=bool)
+        for heading in range(len(headings)):
+            move = moves[heading]
+            permissible = wall[:, 1 + move[0]:walls_dim - 1 + move[0]:2, 1 + move[1]:walls_dim - 1 + move[1]:2] == 0
+            permissible = permissible.reshape(count, cells)
+            run = permissible
+            for movement in range(1, max_movement + 1):
+                runs[rows.index((movement, heading))] = run
+                run = run & shift(permissible, movement * self.step[heading])
+
+        value = np.full((count, cells), unreachable, dtype=np.int32)
+        policy_heading = np.full((count, cells), -1, dtype=np.int8)
+        policy_movement = np.zeros((count, cells), dtype=np.int8)
+        value[:, self.goals] = 0
+
+        target = self.cells()[lanes]
+        frontier = np.tile(self.goals, (count, 1))
+        time = 0
+        free = ~self.goals[None, :].repeat(count, axis=0)
+        shifted = np.zeros((count, cells), dtype=bool)
+        while frontier.any() and (value[np.arange(count), target] == unreachable).any():
+            time += 1
+            found = np.zeros((count, cells), dtype=bool)
+            # rows are in order of preference, so the first row wins
+            for row, (movement, heading) in enumerate(rows):
+                cells_found = shift(frontier, movement * self.step[heading], shifted)
+                cells_found &= runs[row]
+                cells_found &= free
+                if cells_found.any():
+                    policy_heading[cells_found] = heading
+                    policy_movement[cells_found] = movement
+                    free &= ~cells_found
+                    found |= cells_found
+            value[found] = time
+            frontier = found
+
+        self.value[lanes] = value
+        self.policy_heading[lanes] = policy_heading
+        self.policy_movement[lanes] = policy_movement
+        self.planned[lanes] = True
+
+
+def shift(mask, offset, out=None):
+    """
+    Returns (N, cells) mask where every cell holds the value of the cell
+    `offset` further along the flattened cells, False beyond the edge.
+    The result is written to `out` array, if given.
+    """
+
+    shifted = np.zeros_like(mask) if out is None else out
+    if offset > 0:
+        shifted[:, :-offset] = mask[:, offset:]
+        shifted[:, -offset:] = False
+    else:
+        shifted[:, -offset:] = mask[:, :offset]
+        shifted[:, :-offset] = False
+    return shifted
+
+
+def evaluate(mazes, max_time=max_time):
+    """
+    Runs trials of the vectorized robot on all mazes in lockstep.
+    Returns Lanes with runtimes and scores of every maze.
+    """
+
+    lanes = Lanes(mazes, max_time)
+    robots = Robots(lanes.size, lanes.dim)
+    while not lanes.done.all():
+        rotation, movement, reset = robots.next_moves(lanes.sense(), ~lanes.done)
+        lanes.step(rotation, movement, reset)
+
+    return lanes
+
+
+if __name__ == '__main__':
+    '''
+    This script evaluates the vectorized robot on generated mazes or maze
+    files in a single process.
+    '''
+
+    from generator import generate, topologies
+
+    parser = argparse.ArgumentParser(description='Evaluate the vectorized robot on many mazes in lockstep.')
+    parser.add_argument('mazes', nargs='*', help='maze files of the same dimensions')
+    parser.add_argument('-n', '--number', type=int, default=100, help='number of generated mazes')
+    parser.add_argument('-d', '--dim', type=int, default=16, help='dimensions of generated mazes')
+    parser.add_argument('-t', '--topology', choices=topologies, default='apec', help='topology of generated mazes')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the first generated maze')
+    args = parser.parse_args()
+
+    if args.mazes:
+        mazes = [Maze(filename) for filename in args.mazes]
+    else:
+        mazes = [generate(args.dim, args.topology, seed) for seed in range(args.seed, args.seed + args.number)]
+
+    start = time.time()
+    lanes = evaluate(mazes)
+    elapsed = time.time() - start
+
+    scores = lanes.scores()
+    completed = ~np.isnan(scores)
+    print 'Completed {} of {} mazes in {:.2f} s, {:.0f} steps per second.'.format(
+        completed.sum(), lanes.size, elapsed, lanes.time.sum() / elapsed)
+    if completed.any():
+        print 'Mean score: {:4.3f}'.format(scores[completed].mean())